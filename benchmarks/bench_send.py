@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Drives sendgridEmail.do_command against a local SendGrid stand-in at increasing concurrency.
+
+The stand-in runs in a separate process (tests/sendgrid_stub.py) so its work does not
+compete with the module's event loop. For each scenario and concurrency level, reports
+messages/sec, latency percentiles, event-loop lag and peak RSS, and appends one JSON
+object per run to --output. With --transport memory, sends go to the in-memory recording
+transport instead, so the module's own overhead is measured without any network. With
+--baseline, throughput is compared against a previous results file and the script exits
+non-zero if any run regressed by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.append(str(ROOT))
+
+from viam.proto.app.robot import ComponentConfig
+from viam.utils import dict_to_struct
+
+from src.sendgridEmail import sendgridEmail
+
+TEMPLATE_VAR_COUNT = 30
+ATTACHMENT_SIZE = 1024 * 1024
+LAG_INTERVAL = 0.005
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def scenario_commands(attachment_path):
+    preset_body = "".join(f"<tr><td>Field {i}</td><td><<var{i}>></td></tr>" for i in range(TEMPLATE_VAR_COUNT))
+    attributes = {
+        "attachment_dirs": [os.path.dirname(attachment_path)],
+        "preset_messages": {
+            "report": {
+                "subject": "Report for <<var0>>",
+                "body": f"<html><body><table>{preset_body}</table></body></html>"
+            }
+        }
+    }
+    base = {"command": "send", "to": ["bench@example.com"], "from": "robot@example.com"}
+    commands = {
+        "plain": {**base, "subject": "Benchmark", "body": "<p>Benchmark message</p>"},
+        "preset": {
+            **base,
+            "preset": "report",
+            "template_vars": {f"var{i}": f"value {i}" for i in range(TEMPLATE_VAR_COUNT)}
+        },
+        "attachment": {
+            **base,
+            "subject": "Benchmark",
+            "body": "<p>Benchmark message</p>",
+            "attachments": [{"path": attachment_path, "mime_type": "application/octet-stream"}]
+        },
+    }
+    return attributes, commands
+
+
+async def measure_lag(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(time.perf_counter() - start - LAG_INTERVAL)
+
+
+async def run(stub_url, attributes, command, concurrency, messages, transport):
+    config = ComponentConfig(name="bench", attributes=dict_to_struct({
+        "api_key": "SG.bench",
+        "transport": transport,
+        **({"api_host": stub_url} if stub_url else {}),
+        "max_concurrent_sends": concurrency,
+        "pool_size": concurrency,
+        **attributes,
+    }))
+    service = sendgridEmail.new(config, {})
+
+    latencies = []
+    errors = 0
+    remaining = messages
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            result = await service.do_command(command)
+            latencies.append(time.perf_counter() - start)
+            if "error" in result:
+                errors += 1
+
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(lag_samples, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    await service.close()
+
+    latencies.sort()
+    lag_samples.sort()
+    return {
+        "messages": messages,
+        "errors": errors,
+        "elapsed": elapsed,
+        "messages_per_sec": messages / elapsed,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "loop_lag_p99": percentile(lag_samples, 0.99),
+        "loop_lag_max": lag_samples[-1] if lag_samples else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def start_stub(args):
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "tests.sendgrid_stub",
+            "--latency", str(args.latency),
+            "--error-rate", str(args.error_rate),
+            "--throttle-rate", str(args.throttle_rate),
+            "--retry-after", str(args.retry_after),
+        ],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return process, process.stdout.readline().strip()
+
+
+def compare(results, baseline_path, tolerance):
+    baseline = {}
+    with open(baseline_path) as f:
+        for line in f:
+            run = json.loads(line)
+            baseline[(run["scenario"], run["concurrency"], run.get("transport", "sendgrid"))] = run
+    regressions = []
+    for run in results:
+        previous = baseline.get((run["scenario"], run["concurrency"], run["transport"]))
+        if previous and run["messages_per_sec"] < previous["messages_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{run['scenario']} @ {run['concurrency']}: {run['messages_per_sec']:.1f} msg/s, "
+                f"baseline {previous['messages_per_sec']:.1f} msg/s"
+            )
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="plain,preset,attachment")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="comma-separated concurrency levels")
+    parser.add_argument("--messages", type=int, default=500, help="messages per run")
+    parser.add_argument("--latency", type=float, default=0.02, help="stand-in server response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", default="0", help="Retry-After sent with injected 429s")
+    parser.add_argument("--transport", choices=["sendgrid", "memory"], default="sendgrid", help="memory sends without the stand-in server")
+    parser.add_argument("--output", default="bench_results.jsonl", help="file to append JSON results to")
+    parser.add_argument("--baseline", help="previous results file to compare throughput against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional throughput drop versus baseline")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+        f.write(os.urandom(ATTACHMENT_SIZE))
+        attachment_path = f.name
+    attributes, commands = scenario_commands(attachment_path)
+
+    process, stub_url = start_stub(args) if args.transport == "sendgrid" else (None, None)
+    results = []
+    try:
+        print(f"{'scenario':<12}{'conc':>6}{'msg/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'lag p99 ms':>12}{'errors':>8}{'rss MB':>9}")
+        for scenario in args.scenarios.split(","):
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                run_result = await run(stub_url, attributes, commands[scenario], concurrency, args.messages, args.transport)
+                run_result = {"scenario": scenario, "concurrency": concurrency, "transport": args.transport, "stub_latency": args.latency, **run_result}
+                results.append(run_result)
+                print(
+                    f"{scenario:<12}{concurrency:>6}{run_result['messages_per_sec']:>10.1f}"
+                    f"{run_result['latency_p50'] * 1000:>10.2f}{run_result['latency_p95'] * 1000:>10.2f}"
+                    f"{run_result['latency_p99'] * 1000:>10.2f}{run_result['loop_lag_p99'] * 1000:>12.2f}"
+                    f"{run_result['errors']:>8}{run_result['peak_rss_mb']:>9.1f}"
+                )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        os.unlink(attachment_path)
+
+    with open(args.output, "a") as f:
+        for run_result in results:
+            f.write(json.dumps({"timestamp": time.time(), **run_result}) + "\n")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Measures how long the module takes to register with viam-server from a cold interpreter.
+
+Each run starts a fresh python3 process. The import run times `import src`, which
+registers the model, and checks that the SendGrid helpers, httpx and sqlite3 are still
+unloaded afterwards. The start run launches `python3 -m src <socket>` as viam-server does
+and times how long it takes for module.start() to be listening on the socket. Bytecode is
+compiled first, as it is after run.sh installs the module.
+
+Reports the median of --runs runs of each and appends one JSON object to --output. The
+script exits non-zero if a deferred dependency was imported at registration, if a median
+exceeds --max-import-ms or --max-start-ms, or, with --baseline, if a median grew by more
+than --tolerance compared with a previous results file.
+"""
+
+import argparse
+import compileall
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# loaded on the first reconfigure or send, never at registration
+DEFERRED_MODULES = ["sendgrid", "httpx", "sqlite3"]
+START_POLL_INTERVAL = 0.001
+START_TIMEOUT = 30.0
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import src
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_seconds": elapsed, "loaded": [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def time_import():
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def time_start():
+    """Returns the seconds from launching the module process until it is listening on its socket."""
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "module.sock")
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-m", "src", socket_path], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                if process.poll() is not None:
+                    raise RuntimeError(f"module exited with status {process.returncode} before listening")
+                if time.perf_counter() - start > START_TIMEOUT:
+                    raise RuntimeError(f"module did not listen within {START_TIMEOUT}s")
+                time.sleep(START_POLL_INTERVAL)
+            return time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def compare(result, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        previous = [json.loads(line) for line in f][-1]
+    regressions = []
+    for name in ("import_ms", "start_ms"):
+        if result[name] > previous[name] * (1 + tolerance):
+            regressions.append(f"{name}: {result[name]:.1f} ms, baseline {previous[name]:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes to time for each measurement")
+    parser.add_argument("--max-import-ms", type=float, help="fail if the median import time exceeds this")
+    parser.add_argument("--max-start-ms", type=float, help="fail if the median time to module.start() exceeds this")
+    parser.add_argument("--output", default="bench_startup.jsonl", help="file to append JSON results to")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional slowdown versus baseline")
+    args = parser.parse_args()
+
+    compileall.compile_dir(ROOT / "src", quiet=1)
+
+    imports = [time_import() for _ in range(args.runs)]
+    starts = [time_start() for _ in range(args.runs)]
+    loaded = sorted({module for run in imports for module in run["loaded"]})
+    result = {
+        "import_ms": statistics.median(run["import_seconds"] for run in imports) * 1000,
+        "start_ms": statistics.median(starts) * 1000,
+        "start_max_ms": max(starts) * 1000,
+        "loaded_at_registration": loaded,
+        "python": sys.version.split()[0],
+    }
+    print(f"import src:         {result['import_ms']:.1f} ms (median of {args.runs})")
+    print(f"to module.start():  {result['start_ms']:.1f} ms (median), {result['start_max_ms']:.1f} ms (max)")
+
+    with open(args.output, "a") as f:
+        f.write(json.dumps({"timestamp": time.time(), **result}) + "\n")
+
+    failures = [f"{module} is imported at registration" for module in loaded]
+    if args.max_import_ms is not None and result["import_ms"] > args.max_import_ms:
+        failures.append(f"import_ms: {result['import_ms']:.1f} ms, limit {args.max_import_ms:.1f} ms")
+    if args.max_start_ms is not None and result["start_ms"] > args.max_start_ms:
+        failures.append(f"start_ms: {result['start_ms']:.1f} ms, limit {args.max_start_ms:.1f} ms")
+    if args.baseline:
+        failures.extend(compare(result, args.baseline, args.tolerance))
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
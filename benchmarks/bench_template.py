@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compares compiled preset rendering with the per-variable str.replace loop it replaced.
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.template import CompiledTemplate
+
+VARIABLE_COUNT = 25
+ITERATIONS = 2000
+
+
+def build_preset():
+    rows = "".join(
+        f"<tr><td class=\"label\">Field {i}</td><td class=\"value\"><<var{i}>></td></tr>\n" + "<tr><td colspan=\"2\">&nbsp;</td></tr>\n" * 4
+        for i in range(VARIABLE_COUNT)
+    )
+    body = f"<html><head><style>td {{ padding: 4px; }}</style></head><body><h1>Alert: <<var0>></h1><table>{rows}</table></body></html>"
+    subject = "Alert on <<var1>>: <<var0>>"
+    template_vars = {f"var{i}": f"value {i}" for i in range(VARIABLE_COUNT)}
+    return subject, body, template_vars
+
+
+def replace_loop(subject, body, template_vars):
+    for key, val in template_vars.items():
+        body = body.replace(f"<<{key}>>", val)
+        subject = subject.replace(f"<<{key}>>", val)
+    return subject, body
+
+
+def compiled(subject_template, body_template, template_vars):
+    return subject_template.render(template_vars), body_template.render(template_vars)
+
+
+def main():
+    subject, body, template_vars = build_preset()
+    subject_template = CompiledTemplate(subject)
+    body_template = CompiledTemplate(body)
+    assert replace_loop(subject, body, template_vars) == compiled(subject_template, body_template, template_vars)
+
+    baseline = min(timeit.repeat(lambda: replace_loop(subject, body, template_vars), number=ITERATIONS, repeat=5))
+    optimized = min(timeit.repeat(lambda: compiled(subject_template, body_template, template_vars), number=ITERATIONS, repeat=5))
+
+    print(f"body size: {len(body)} bytes, {VARIABLE_COUNT} template vars")
+    print(f"str.replace loop: {baseline / ITERATIONS * 1e6:.2f} us/render")
+    print(f"compiled:         {optimized / ITERATIONS * 1e6:.2f} us/render")
+    print(f"speedup:          {baseline / optimized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
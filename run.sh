@@ -1,20 +1,21 @@
 #!/bin/bash
 cd `dirname $0`
 
-if [ -f .installed ]
+# dependencies are installed on the first run and again only when requirements.txt
+# changes, so a restart goes straight to starting the module
+if [ ! -f .installed ] || [ requirements.txt -nt .installed ]
   then
-    source viam-env/bin/activate
-  else
     python3 -m pip install --user virtualenv --break-system-packages
     python3 -m venv viam-env
-    source viam-env/bin/activate
-    pip3 install --upgrade -r requirements.txt
+    viam-env/bin/pip3 install --upgrade -r requirements.txt
     if [ $? -eq 0 ]
       then
+        # compiled now so the first start does not pay for it, even if the directory is read-only later
+        viam-env/bin/python3 -m compileall -q src
         touch .installed
     fi
 fi
 
 # Be sure to use `exec` so that termination signals reach the python process,
 # or handle forwarding termination signals manually
-exec python3 -m src $@
+exec viam-env/bin/python3 -m src $@
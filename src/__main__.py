@@ -1,5 +1,4 @@
 import asyncio
-import sys
 
 from viam.module.module import Module
 from viam.services.generic import Generic
@@ -0,0 +1,97 @@
+"""
+Loading and caching of attachments read from local files.
+"""
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+# SendGrid rejects messages over 30 MB, counting attachments after base64 encoding
+MAX_MESSAGE_SIZE = 30 * 1024 * 1024
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# a multiple of 3 bytes, so each chunk encodes without padding and the pieces can be joined
+READ_CHUNK_SIZE = 3 * 256 * 1024
+
+
+def encoded_size(size: int) -> int:
+    """Returns the length of the base64 encoding of size bytes."""
+    return 4 * ((size + 2) // 3)
+
+
+class AttachmentCache():
+    """An LRU cache of base64-encoded file contents, bounded by total encoded size.
+
+    Entries are keyed by the SHA-256 of the file content, so the same snapshot or log
+    bundle attached from different paths is encoded and held in memory once. A second
+    index from (path, size, mtime, inode) to content hash lets an unchanged file skip
+    being read at all.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.files: "OrderedDict[Tuple[str, int, int, int], str]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path: str) -> str:
+        """Returns the base64 encoding of the file at path. Blocking; run off the event loop."""
+        stat = os.stat(path)
+        file_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self.lock:
+            digest = self.files.get(file_key)
+            if digest is not None and digest in self.entries:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return self.entries[digest]
+
+        digest, encoded = self._encode(path)
+        with self.lock:
+            self.files[file_key] = digest
+            self.files.move_to_end(file_key)
+            cached = self.entries.get(digest)
+            if cached is not None:
+                # same content as another file; keep the copy already held
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            if len(encoded) <= self.max_bytes:
+                self.entries[digest] = encoded
+                self.size += len(encoded)
+                self._evict()
+        return encoded
+
+    @staticmethod
+    def _encode(path: str) -> Tuple[str, str]:
+        digest = hashlib.sha256()
+        pieces = []
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                pieces.append(base64.b64encode(chunk).decode("ascii"))
+        return digest.hexdigest(), "".join(pieces)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        while len(self.files) > max(len(self.entries) * 4, 64):
+            self.files.popitem(last=False)
+
+    def resize(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
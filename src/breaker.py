@@ -0,0 +1,163 @@
+"""
+Circuit breaker that stops sends from waiting on SendGrid while it is failing.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from .transport import SendError
+
+DEFAULT_FAILURE_RATE = 0.5
+DEFAULT_MIN_REQUESTS = 20
+DEFAULT_WINDOW = 30.0
+DEFAULT_OPEN_TIME = 30.0
+# outcomes are counted in this many buckets spanning the window, so the failure rate
+# covers roughly the last window seconds at a fixed memory cost
+WINDOW_BUCKETS = 10
+WAIT_POLL_INTERVAL = 0.1
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_outage(e: Exception) -> bool:
+    """Returns whether a failed request says SendGrid is unavailable, rather than that the request was refused."""
+    if isinstance(e, SendError):
+        return e.status_code == 408 or e.status_code >= 500
+    import httpx
+    return isinstance(e, (asyncio.TimeoutError, httpx.TransportError))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while the circuit is open."""
+
+    def __init__(self):
+        super().__init__("circuit breaker is open: SendGrid is failing")
+
+
+class CircuitBreaker():
+    """Trips when too many recent requests fail or are too slow, and probes before closing.
+
+    While closed, each request's outcome is counted in a sliding window. Once the window
+    holds at least min_requests and the share of failures reaches failure_rate, the circuit
+    opens and requests are refused without being made. After open_time seconds it turns
+    half open and lets a single probe through: success closes the circuit, failure opens
+    it again. A successful request slower than slow_call seconds counts as a failure.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = DEFAULT_FAILURE_RATE,
+        min_requests: int = DEFAULT_MIN_REQUESTS,
+        window: float = DEFAULT_WINDOW,
+        open_time: float = DEFAULT_OPEN_TIME,
+        slow_call: Optional[float] = None,
+    ):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_time = open_time
+        self.slow_call = slow_call
+        self.bucket_width = window / WINDOW_BUCKETS
+        # [tick, requests, failures] for each bucket
+        self.buckets: List[List[Any]] = [[-1, 0, 0] for _ in range(WINDOW_BUCKETS)]
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+
+    def matches(self, failure_rate: float, min_requests: int, window: float, open_time: float, slow_call: Optional[float]) -> bool:
+        return (self.failure_rate, self.min_requests, self.window, self.open_time, self.slow_call) == \
+            (failure_rate, min_requests, window, open_time, slow_call)
+
+    def allow(self) -> bool:
+        """Returns whether a request may be made now; in the half-open state this takes the probe."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() < self.opened_at + self.open_time:
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record(self, ok: bool, seconds: float):
+        """Counts the outcome of a request that allow() let through."""
+        if ok and self.slow_call is not None and seconds > self.slow_call:
+            ok = False
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+        if self.state == OPEN:
+            # started before the circuit opened
+            return
+        tick = int(time.monotonic() / self.bucket_width)
+        bucket = self.buckets[tick % WINDOW_BUCKETS]
+        if bucket[0] != tick:
+            bucket[:] = [tick, 0, 0]
+        bucket[1] += 1
+        if not ok:
+            bucket[2] += 1
+            requests, failures = self._totals()
+            if requests >= self.min_requests and failures / requests >= self.failure_rate:
+                self._open()
+
+    def abandon(self):
+        """Gives back a probe whose request was cancelled before it finished."""
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    async def wait(self):
+        """Returns once allow() could let a request through."""
+        while True:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.open_time - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                return
+            if self.state == HALF_OPEN and not self.probing:
+                return
+            await asyncio.sleep(max(remaining, WAIT_POLL_INTERVAL) if self.state == OPEN else WAIT_POLL_INTERVAL)
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opens += 1
+
+    def _close(self):
+        self.state = CLOSED
+        for bucket in self.buckets:
+            bucket[:] = [-1, 0, 0]
+
+    def _totals(self):
+        tick = int(time.monotonic() / self.bucket_width)
+        requests = failures = 0
+        for bucket_tick, bucket_requests, bucket_failures in self.buckets:
+            if bucket_tick > tick - WINDOW_BUCKETS:
+                requests += bucket_requests
+                failures += bucket_failures
+        return requests, failures
+
+    def status(self) -> Dict[str, Any]:
+        # reading the state moves an expired open circuit to half open
+        if self.state == OPEN and time.monotonic() >= self.opened_at + self.open_time:
+            self.state = HALF_OPEN
+            self.probing = False
+        requests, failures = self._totals()
+        return {
+            "state": self.state,
+            "requests": requests,
+            "failures": failures,
+            "failure_rate": failures / requests if requests else 0.0,
+            "opens": self.opens,
+            "retry_in": max(self.opened_at + self.open_time - time.monotonic(), 0.0) if self.state == OPEN else 0.0,
+        }
@@ -0,0 +1,132 @@
+"""
+Windowed de-duplication of repeated preset messages, with digest emails.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+from viam.logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+DEFAULT_MAX_WINDOWS = 10000
+
+
+class CoalesceWindow():
+    """Tracks the duplicates of one message seen since its window opened.
+
+    first is resolved with None once the first message is sent, or with the error it
+    failed with.
+    """
+
+    __slots__ = ("command", "subject", "html_content", "first_seen", "last_seen", "suppressed", "timer", "first")
+
+    def __init__(self, command: Mapping[str, Any], subject: str, html_content: str):
+        self.command = command
+        self.subject = subject
+        self.html_content = html_content
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+        self.suppressed = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.first: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class Coalescer():
+    """Suppresses repeats of a message within a time window.
+
+    The first message for a key opens a window and is sent as usual, and the sender reports
+    how it went with first_sent or first_failed. Repeats within the window are counted
+    instead of sent, and when the window closes, send_digest is called once with the window
+    if anything was suppressed. If the first message fails, its window is closed without a
+    digest and the next repeat is sent as a first message; repeats held while it was in
+    flight are given its error rather than dropped silently. At most max_windows windows
+    are held; beyond that the oldest is closed early, so its digest is sent rather than
+    dropped.
+    """
+
+    def __init__(self, send_digest: Callable[[CoalesceWindow], Awaitable[Any]], max_windows: int = DEFAULT_MAX_WINDOWS):
+        self.send_digest = send_digest
+        self.max_windows = max_windows
+        self.windows: "OrderedDict[Hashable, CoalesceWindow]" = OrderedDict()
+        self.pending: set = set()
+        self.suppressed_total = 0
+        self.digests_sent = 0
+
+    def offer(
+        self, key: Hashable, window: float, command: Mapping[str, Any], subject: str, html_content: str
+    ) -> Tuple[CoalesceWindow, bool]:
+        """Returns the window for this message, and whether it is a repeat to suppress rather than send.
+
+        A repeat should wait for the window's first to learn whether the first message was sent.
+        """
+        current = self.windows.get(key)
+        if current is not None:
+            current.command = command
+            current.subject = subject
+            current.html_content = html_content
+            current.last_seen = time.time()
+            current.suppressed += 1
+            self.suppressed_total += 1
+            return current, True
+
+        current = CoalesceWindow(command, subject, html_content)
+        current.timer = asyncio.get_running_loop().call_later(window, self._close, key)
+        self.windows[key] = current
+        while len(self.windows) > self.max_windows:
+            self._close(next(iter(self.windows)))
+        return current, False
+
+    def first_sent(self, current: CoalesceWindow):
+        if not current.first.done():
+            current.first.set_result(None)
+
+    def first_failed(self, key: Hashable, current: CoalesceWindow, error: str):
+        """Closes the window without a digest, failing the repeats held for it with error."""
+        if current.first.done():
+            return
+        if self.windows.get(key) is current:
+            del self.windows[key]
+            current.timer.cancel()
+        # the repeats are answered with the error, so they were never suppressed
+        self.suppressed_total -= current.suppressed
+        current.first.set_result(error)
+
+    def _close(self, key: Hashable):
+        current = self.windows.pop(key, None)
+        if current is None:
+            return
+        current.timer.cancel()
+        if current.suppressed == 0:
+            return
+        if current.first.done():
+            self._send_later(current)
+        else:
+            # the window outlasted the first send; the digest waits to learn whether it went
+            current.first.add_done_callback(lambda _: self._send_later(current))
+
+    def _send_later(self, current: CoalesceWindow):
+        if current.first.result() is not None:
+            return
+        task = asyncio.ensure_future(self._send(current))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _send(self, current: CoalesceWindow):
+        try:
+            await self.send_digest(current)
+            self.digests_sent += 1
+        except Exception as e:
+            LOGGER.error(f"Failed to send digest email: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"open_windows": len(self.windows), "suppressed": self.suppressed_total, "digests_sent": self.digests_sent}
+
+    async def close(self):
+        """Closes every open window, sending outstanding digests."""
+        for key in list(self.windows):
+            self._close(key)
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
@@ -0,0 +1,127 @@
+"""
+Bounded, expiring record of the delivery state of messages sent in the background.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_STATUS_CAPACITY = 10000
+DEFAULT_STATUS_TTL = 86400.0
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class DeliveryRecord():
+    """The delivery state of one message.
+
+    A message that was split into several requests is sent once every request is, and
+    reports the status_code and sendgrid_id of the first; a failure of any request fails it.
+    """
+
+    __slots__ = ("message_id", "created", "state", "status_code", "sendgrid_id", "error", "requests", "outstanding")
+
+    def __init__(self, message_id: str, created: float):
+        self.message_id = message_id
+        self.created = created
+        self.state = PENDING
+        self.status_code: Optional[int] = None
+        self.sendgrid_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.requests = 1
+        self.outstanding = 1
+
+    def split(self, requests: int):
+        self.requests = self.outstanding = requests
+
+    def sent(self, response: Any):
+        self.outstanding -= 1
+        if self.status_code is None:
+            self.status_code = response.status_code
+            self.sendgrid_id = response.headers.get("x-message-id")
+        if self.outstanding <= 0 and self.state == PENDING:
+            self.state = SENT
+
+    def failed(self, error: str):
+        self.state = FAILED
+        self.error = error
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {"state": self.state}
+        if self.requests > 1:
+            record["requests"] = self.requests
+        if self.state == SENT:
+            record["status_code"] = self.status_code
+            if self.sendgrid_id:
+                record["sendgrid_message_id"] = self.sendgrid_id
+        elif self.state == FAILED:
+            record["error"] = self.error
+        return record
+
+
+class DeliveryLog():
+    """A fixed-size ring of delivery records, indexed by message id.
+
+    Records are written in creation order, so the oldest is always next to be overwritten
+    and expired records are dropped from the oldest end. Memory is bounded by capacity no
+    matter how long the module runs; a record that has been overwritten or has outlived
+    ttl seconds is reported as unknown.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_STATUS_CAPACITY, ttl: float = DEFAULT_STATUS_TTL):
+        self.ttl = ttl
+        self.slots: List[Optional[DeliveryRecord]] = [None] * capacity
+        self.index: Dict[str, int] = {}
+        self.head = 0
+        self.size = 0
+
+    def resize(self, capacity: int):
+        if capacity == len(self.slots):
+            return
+        records = self._records()[-capacity:]
+        self.slots = records + [None] * (capacity - len(records))
+        self.index = {record.message_id: slot for slot, record in enumerate(records)}
+        self.head = len(records) % capacity
+        self.size = len(records)
+
+    def add(self, message_id: str) -> DeliveryRecord:
+        now = time.time()
+        self._expire(now)
+        previous = self.slots[self.head]
+        if previous is not None:
+            self._unindex(previous, self.head)
+        else:
+            self.size += 1
+        record = self.slots[self.head] = DeliveryRecord(message_id, now)
+        self.index[message_id] = self.head
+        self.head = (self.head + 1) % len(self.slots)
+        return record
+
+    def get(self, message_id: str) -> Optional[DeliveryRecord]:
+        self._expire(time.time())
+        slot = self.index.get(message_id)
+        return self.slots[slot] if slot is not None else None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _records(self) -> List[DeliveryRecord]:
+        """Returns the live records, oldest first."""
+        oldest = (self.head - self.size) % len(self.slots)
+        return [self.slots[(oldest + i) % len(self.slots)] for i in range(self.size)]
+
+    def _expire(self, now: float):
+        while self.size:
+            oldest = (self.head - self.size) % len(self.slots)
+            record = self.slots[oldest]
+            if record.created > now - self.ttl:
+                return
+            self.slots[oldest] = None
+            self._unindex(record, oldest)
+            self.size -= 1
+
+    def _unindex(self, record: DeliveryRecord, slot: int):
+        # a message id added twice points at its newest record
+        if self.index.get(record.message_id) == slot:
+            del self.index[record.message_id]
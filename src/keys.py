@@ -0,0 +1,78 @@
+"""
+Spreads sends across several SendGrid API keys, each with its own rate budget.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+from .ratelimit import TokenBucket
+from .transport import Transport
+
+DEFAULT_KEY_EJECT_TIME = 60.0
+# statuses that say something about the key rather than the message
+KEY_ERROR_STATUSES = (401, 403, 429)
+
+
+class ApiKey():
+    """One API key with its own connection pool, rate budget and health."""
+
+    def __init__(self, key: str, name: str, weight: float, transport: Transport, rate_limiter: TokenBucket):
+        self.key = key
+        self.name = name
+        self.weight = weight
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.in_flight = 0
+        self.requests = 0
+        self.sent = 0
+        self.failed = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.last_error: Optional[int] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "sent": self.sent,
+            "failed": self.failed,
+            "ejections": self.ejections,
+            "ejected_for": max(self.ejected_until - time.monotonic(), 0.0),
+            "last_error": self.last_error,
+        }
+
+
+class KeyPool():
+    """Picks the least-loaded healthy key for each send, relative to its weight.
+
+    Load counts sends waiting on a key's rate budget as well as requests in flight, so a key
+    that has spent its budget stops attracting new sends. Among equally loaded keys the one
+    with the fewest requests per unit of weight is picked, which makes light traffic a
+    weighted round robin. A key that answers 401, 403 or 429 is ejected for a while; if every
+    key is ejected, the one that comes back first is used rather than failing the send.
+    """
+
+    def __init__(self, keys: List[ApiKey], eject_time: float = DEFAULT_KEY_EJECT_TIME):
+        self.keys = keys
+        self.eject_time = eject_time
+
+    def select(self) -> ApiKey:
+        now = time.monotonic()
+        healthy = [key for key in self.keys if key.ejected_until <= now]
+        if not healthy:
+            return min(self.keys, key=lambda key: key.ejected_until)
+        return min(healthy, key=lambda key: (key.in_flight / key.weight, key.requests / key.weight))
+
+    def eject(self, key: ApiKey, delay: Optional[float] = None):
+        key.ejections += 1
+        key.ejected_until = max(key.ejected_until, time.monotonic() + (self.eject_time if delay is None else delay))
+
+    def healthy(self, other_than: Optional[ApiKey] = None) -> bool:
+        """Returns whether any key is in rotation, leaving out other_than if given."""
+        now = time.monotonic()
+        return any(key.ejected_until <= now for key in self.keys if key is not other_than)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [key.stats() for key in self.keys]
@@ -0,0 +1,103 @@
+"""
+Pre-flight checks of mail send payloads against SendGrid's per-request limits, and splitting
+of payloads that exceed them into requests that do not.
+"""
+
+import json
+from typing import Any, Dict, List, Mapping
+
+from .transport import PreparedPayload
+
+RECIPIENT_FIELDS = ("to", "cc", "bcc")
+# a request body is assembled as BODY_PREFIX, the personalizations joined by SEPARATOR, "]",
+# then the rest of the message
+BODY_PREFIX = b'{"personalizations": ['
+SEPARATOR = b", "
+
+
+def recipient_count(personalization: Mapping[str, Any]) -> int:
+    return sum(len(personalization.get(field) or []) for field in RECIPIENT_FIELDS)
+
+
+def _divide(personalization: Dict[str, Any], max_recipients: int) -> List[Dict[str, Any]]:
+    """Splits a personalization with too many recipients into several, each within max_recipients.
+
+    Its to addresses are shared out in order; cc and bcc stay with the first part only, so
+    nobody gets the message twice.
+    """
+    copied = recipient_count(personalization) - len(personalization.get("to") or [])
+    room = max_recipients - copied
+    if room < 1:
+        raise ValueError(f"a message has {copied} cc and bcc recipients, over SendGrid's {max_recipients} recipient limit")
+    to = personalization.get("to") or []
+    parts = [{**personalization, "to": to[:room]}]
+    rest = {key: value for key, value in personalization.items() if key not in ("cc", "bcc")}
+    for start in range(room, len(to), max_recipients):
+        parts.append({**rest, "to": to[start:start + max_recipients]})
+    return parts
+
+
+def split_payload(
+    payload: Mapping[str, Any], max_recipients: int, max_personalizations: int, max_size: int
+) -> List[PreparedPayload]:
+    """Returns payload as requests that each keep within SendGrid's limits, ready to send.
+
+    A request may carry at most max_personalizations personalizations, max_recipients
+    recipients across all of them, and max_size bytes once serialized. A payload within
+    all three is returned as a single request. Otherwise personalizations are packed into
+    requests in order, each filled before the next is started, and a personalization with
+    more than max_recipients recipients is first divided into several. With one recipient
+    per personalization, as sends and batches make, this gives the fewest requests possible.
+
+    Everything but the personalizations is serialized once and the encoding shared by
+    every request, so attachments are not encoded again for each one. Raises ValueError if
+    the message is over max_size even with a single recipient.
+    """
+    personalizations = payload.get("personalizations") or []
+    if (
+        len(personalizations) <= max_personalizations
+        and sum(recipient_count(personalization) for personalization in personalizations) <= max_recipients
+    ):
+        # the usual case: encoded whole, once, and sent with that encoding if it is small enough
+        if not isinstance(payload, PreparedPayload):
+            payload = PreparedPayload(payload, json.dumps(payload).encode("utf-8"))
+        if len(payload.body) <= max_size:
+            return [payload]
+
+    base = {key: value for key, value in payload.items() if key != "personalizations"}
+    # the encoding of base without its opening brace, appended to every request
+    suffix = b"], " + json.dumps(base).encode("utf-8")[1:] if base else b"]}"
+    overhead = len(BODY_PREFIX) + len(suffix)
+    if overhead > max_size:
+        raise ValueError(f"message is {overhead} bytes without its recipients, over SendGrid's {max_size} byte request limit")
+
+    def request(chunk: List[Dict[str, Any]], encoded: List[bytes]) -> PreparedPayload:
+        return PreparedPayload({"personalizations": chunk, **base}, BODY_PREFIX + SEPARATOR.join(encoded) + suffix)
+
+    requests = []
+    chunk: List[Dict[str, Any]] = []
+    encoded: List[bytes] = []
+    size = overhead
+    recipients = 0
+    for personalization in personalizations:
+        count = recipient_count(personalization)
+        for part in _divide(personalization, max_recipients) if count > max_recipients else [personalization]:
+            part_encoded = json.dumps(part).encode("utf-8")
+            part_count = recipient_count(part)
+            if overhead + len(part_encoded) > max_size:
+                raise ValueError(
+                    f"message is {overhead + len(part_encoded)} bytes for a single recipient, over SendGrid's {max_size} byte request limit"
+                )
+            if chunk and (
+                len(chunk) >= max_personalizations
+                or recipients + part_count > max_recipients
+                or size + len(SEPARATOR) + len(part_encoded) > max_size
+            ):
+                requests.append(request(chunk, encoded))
+                chunk, encoded, size, recipients = [], [], overhead, 0
+            size += len(part_encoded) + (len(SEPARATOR) if chunk else 0)
+            recipients += part_count
+            chunk.append(part)
+            encoded.append(part_encoded)
+    requests.append(request(chunk, encoded))
+    return requests
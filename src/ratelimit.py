@@ -0,0 +1,86 @@
+"""
+Client-side rate limiting and retry backoff for SendGrid requests.
+"""
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from .transport import SendError
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 30.0
+
+
+class TokenBucket():
+    """An asyncio token bucket shared by every send on a resource.
+
+    Tokens are reserved in arrival order, so waiting sends are released at the configured
+    rate instead of all retrying at once. A rate of None disables the limit. pause() holds
+    back every send until a server-imposed wait (such as Retry-After) has passed.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def matches(self, rate: Optional[float], burst: Optional[float]) -> bool:
+        return self.rate == rate and self.burst == (burst if burst is not None else max(1.0, rate or 1.0))
+
+    def pause(self, delay: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = max(self.paused_until - now, 0.0)
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def is_retryable(e: Exception) -> bool:
+    """Returns whether a failed send is safe and worthwhile to repeat."""
+    if isinstance(e, SendError):
+        return e.status_code == 429 or e.status_code >= 500
+    import httpx
+    # the request never reached SendGrid, so repeating it cannot duplicate the message
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def server_delay(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Returns how long the server asked us to wait, from Retry-After or X-RateLimit-Reset."""
+    if not headers:
+        return None
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get("x-ratelimit-reset")
+    if reset:
+        try:
+            return max(float(reset) - time.time(), 0.0)
+        except ValueError:
+            pass
+    return None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with equal jitter: half the delay is fixed, half is random."""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
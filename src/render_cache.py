@@ -0,0 +1,102 @@
+"""
+Caching of rendered, serialized mail payloads for repeated preset sends.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from .transport import PreparedPayload
+
+DEFAULT_RENDER_CACHE_BYTES = 8 * 1024 * 1024
+
+
+def template_vars_digest(template_vars: Mapping[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(template_vars, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class RenderedMessage():
+    """A rendered preset message, with everything but its recipients serialized once."""
+
+    __slots__ = ("preset", "subject", "html_content", "base", "tail", "size")
+
+    def __init__(self, preset: Any, subject: str, html_content: str, payload: Mapping[str, Any]):
+        self.preset = preset
+        self.subject = subject
+        self.html_content = html_content
+        self.base = {key: value for key, value in payload.items() if key != "personalizations"}
+        # the encoding of base without its opening brace, so recipients can be spliced in front
+        self.tail = json.dumps(self.base).encode("utf-8")[1:]
+        self.size = len(self.tail) + len(subject) + len(html_content)
+
+    def payload(self, to: Union[str, List[str]]) -> PreparedPayload:
+        """Returns the payload for sending this message to the given recipients."""
+        from sendgrid.helpers.mail import Personalization, To
+        personalization = Personalization()
+        for email in [to] if isinstance(to, str) else to:
+            personalization.add_to(To(email))
+        personalizations = [personalization.get()]
+        body = b'{"personalizations": ' + json.dumps(personalizations).encode("utf-8") + (b", " + self.tail if self.base else b"}")
+        return PreparedPayload({"personalizations": personalizations, **self.base}, body)
+
+
+class RenderCache():
+    """An LRU cache of rendered preset messages, bounded by their total size.
+
+    Keys are (preset, from, from_name, template_vars digest), without recipients. Each
+    entry remembers the compiled preset it was rendered from, so an entry rendered before
+    a reconfigure edited the preset is never returned after it, even if a send that was
+    in flight during the reconfigure stores it late.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple, RenderedMessage]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, preset: Any) -> Optional[RenderedMessage]:
+        rendered = self.entries.get(key)
+        if rendered is None or rendered.preset is not preset:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return rendered
+
+    def put(self, key: Tuple, rendered: RenderedMessage):
+        if rendered.size > self.max_bytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous.size
+        self.entries[key] = rendered
+        self.size += rendered.size
+        self._evict()
+
+    def invalidate(self, presets: Iterable[str]):
+        """Drops every entry rendered from one of the named presets."""
+        presets = set(presets)
+        for key in [key for key in self.entries if key[0] in presets]:
+            self.size -= self.entries.pop(key).size
+
+    def resize(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,180 @@
+"""
+Messages held until a send time, persisted to SQLite and released by a single timer task.
+"""
+
+import asyncio
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from viam.logging import getLogger
+
+if TYPE_CHECKING:
+    import sqlite3
+
+LOGGER = getLogger(__name__)
+
+# the wall clock can be stepped (NTP, a robot booting without an RTC), so a long wait is
+# broken up and the heap rechecked against the clock at least this often
+MAX_TIMER_SLEEP = 60.0
+
+
+def parse_send_at(value: Any) -> float:
+    """Returns send_at, given as epoch seconds or an ISO 8601 string, as epoch seconds.
+
+    An ISO time without a UTC offset is taken to be UTC.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value):
+            raise ValueError(f"send_at {value} is not a finite number of epoch seconds")
+        return float(value)
+    if isinstance(value, str):
+        try:
+            send_at = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"send_at '{value}' is not an ISO 8601 time")
+        if send_at.tzinfo is None:
+            send_at = send_at.replace(tzinfo=timezone.utc)
+        return send_at.timestamp()
+    raise ValueError("send_at must be epoch seconds or an ISO 8601 string")
+
+
+class Scheduler():
+    """Holds messages until their send time, then passes each to fire.
+
+    Pending messages are kept in a heap ordered by send time and waited on by one asyncio
+    task, which exits while nothing is scheduled. Every message is written to SQLite before
+    it is accepted and deleted only after fire returns, so messages survive a restart and
+    one interrupted while firing is fired again. The database file is only created when
+    the first message is scheduled.
+    """
+
+    def __init__(self, path: str, fire: Callable[[str, Dict[str, Any]], Awaitable[Any]]):
+        self.path = path
+        self.fire = fire
+        self.lock = threading.Lock()
+        self.db: Optional["sqlite3.Connection"] = None
+        self.heap: List[Tuple[float, int, str]] = []
+        self.entries: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.sequence = 0
+        self.wakeup = asyncio.Event()
+        self.firing: set = set()
+        self.task: Optional[asyncio.Task] = None
+        if os.path.exists(path):
+            self._connect()
+            rows = self.db.execute("SELECT id, send_at, entry FROM schedule").fetchall()
+            for message_id, send_at, entry in rows:
+                self._push(message_id, send_at, json.loads(entry))
+            if rows:
+                LOGGER.info(f"loaded {len(rows)} scheduled message(s) from {path}")
+
+    def _connect(self):
+        import sqlite3
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS schedule (
+                id TEXT PRIMARY KEY,
+                send_at REAL NOT NULL,
+                entry TEXT NOT NULL
+            )"""
+        )
+
+    def _push(self, message_id: str, send_at: float, entry: Dict[str, Any]):
+        self.entries[message_id] = (send_at, entry)
+        self.sequence += 1
+        heapq.heappush(self.heap, (send_at, self.sequence, message_id))
+
+    def _insert(self, message_id: str, send_at: float, entry: Mapping[str, Any]):
+        with self.lock:
+            if self.db is None:
+                self._connect()
+            self.db.execute("INSERT INTO schedule (id, send_at, entry) VALUES (?, ?, ?)", (message_id, send_at, json.dumps(entry)))
+
+    def _delete(self, message_id: str):
+        with self.lock:
+            if self.db is not None:
+                self.db.execute("DELETE FROM schedule WHERE id = ?", (message_id,))
+
+    async def add(self, send_at: float, entry: Dict[str, Any], message_id: Optional[str] = None) -> str:
+        message_id = message_id or uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, message_id, send_at, entry)
+        self._push(message_id, send_at, entry)
+        if self.heap[0][2] == message_id:
+            self.wakeup.set()
+        self.start()
+        return message_id
+
+    async def cancel(self, message_id: str) -> bool:
+        # the heap entry is skipped when it comes due, rather than searched for now
+        if self.entries.pop(message_id, None) is None:
+            return False
+        await asyncio.to_thread(self._delete, message_id)
+        return True
+
+    def list(self) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """Returns (id, send_at, entry) for each pending message, soonest first."""
+        return sorted(((message_id, send_at, entry) for message_id, (send_at, entry) in self.entries.items()), key=lambda item: item[1])
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def start(self):
+        if self.task is None and self.entries:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # messages cancelled mid-send stay on disk and are sent again after a restart
+        for task in list(self.firing):
+            task.cancel()
+        if self.firing:
+            await asyncio.gather(*self.firing, return_exceptions=True)
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                _, _, message_id = heapq.heappop(self.heap)
+                scheduled = self.entries.pop(message_id, None)
+                if scheduled is None:
+                    continue
+                task = asyncio.create_task(self._fire(message_id, scheduled[1]))
+                self.firing.add(task)
+                task.add_done_callback(self.firing.discard)
+
+            if not self.entries:
+                # nothing left to wait for; add() starts the timer again
+                self.heap = []
+                self.task = None
+                return
+            wait = MAX_TIMER_SLEEP if not self.heap else min(self.heap[0][0] - now, MAX_TIMER_SLEEP)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, message_id: str, entry: Dict[str, Any]):
+        try:
+            await self.fire(message_id, entry)
+        except Exception as e:
+            LOGGER.error(f"Failed to send scheduled email {message_id}: {e}")
+        await asyncio.to_thread(self._delete, message_id)
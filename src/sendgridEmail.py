@@ -1,11 +1,9 @@
-from typing import ClassVar, Mapping, Sequence, Any, Dict, Optional, Tuple, Final, List, cast
+from typing import TYPE_CHECKING, ClassVar, Mapping, Any, Dict, Optional, Tuple, List
 from typing_extensions import Self
-from typing import Final
 
-from viam.resource.types import RESOURCE_NAMESPACE_RDK, RESOURCE_TYPE_SERVICE
 from viam.module.types import Reconfigurable
 from viam.proto.app.robot import ComponentConfig
-from viam.proto.common import ResourceName, Vector3
+from viam.proto.common import ResourceName
 from viam.resource.base import ResourceBase
 from viam.resource.types import Model, ModelFamily
 
@@ -16,14 +14,97 @@ from viam.utils import ValueTypes, struct_to_dict
 import time
 import asyncio
 import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, Attachment, FileContent, FileName, FileType, Disposition
+import uuid
+import mimetypes
+
+from .breaker import CircuitBreaker, CircuitOpenError, is_outage, DEFAULT_FAILURE_RATE, DEFAULT_MIN_REQUESTS, DEFAULT_WINDOW, DEFAULT_OPEN_TIME
+from .attachments import AttachmentCache, encoded_size, MAX_MESSAGE_SIZE, DEFAULT_CACHE_BYTES
+from .preflight import split_payload
+from .keys import ApiKey, KeyPool, KEY_ERROR_STATUSES, DEFAULT_KEY_EJECT_TIME
+from .delivery import DeliveryLog, DeliveryRecord, FAILED, DEFAULT_STATUS_CAPACITY, DEFAULT_STATUS_TTL
+from .coalesce import Coalescer, CoalesceWindow, DEFAULT_MAX_WINDOWS
+from .ratelimit import TokenBucket, is_retryable, server_delay, backoff_delay, DEFAULT_MAX_RETRIES, DEFAULT_RETRY_BASE_DELAY, DEFAULT_RETRY_MAX_DELAY
+from .render_cache import RenderCache, RenderedMessage, template_vars_digest, DEFAULT_RENDER_CACHE_BYTES
+from .schedule import Scheduler, parse_send_at
+from .spool import Spool, QueueWorker
+from .template import CompiledTemplate
+from .stats import Stats, PrometheusExporter, DEFAULT_STATS_HOST
+from .transport import (
+    Transport, SendGridTransport, MemoryTransport, PreparedPayload, SendError, SMTP_SECURITY,
+    SENDGRID_API_HOST, DEFAULT_POOL_SIZE, DEFAULT_POOL_IDLE_TIMEOUT, DEFAULT_MEMORY_CAPACITY,
+)
+
+# the sendgrid helpers are imported where they are used, so the module registers with
+# viam-server without loading them
+if TYPE_CHECKING:
+    from sendgrid.helpers.mail import Mail
 
 LOGGER = getLogger(__name__)
 
+DEFAULT_MAX_CONCURRENT_SENDS = 10
+DEFAULT_SEND_TIMEOUT = 30.0
+DEFAULT_SPILL_CONCURRENCY = 4
+TRANSPORTS = ("sendgrid", "smtp", "memory")
+# SendGrid accepts at most 1,000 personalizations, and 1,000 recipients across them, in a single mail send request
+MAX_PERSONALIZATIONS = 1000
+MAX_RECIPIENTS = 1000
+# queued messages are spooled to the module's data directory when viam-server provides one
+MODULE_DATA_DIR = os.environ.get("VIAM_MODULE_DATA") or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def validate_number(attributes: Mapping[str, Any], name: str, minimum: float, exclusive: bool = False):
+    value = attributes.get(name)
+    if value is None:
+        return
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < minimum or (exclusive and value == minimum):
+        raise Exception(f"{name} must be a number greater than {'' if exclusive else 'or equal to '}{minimum}")
+
 class Preset():
-    subject: str
-    body: str
+    subject: str = ""
+    body: str = ""
+    template_vars: Optional[List[str]] = None
+    coalesce_window: Optional[float] = None
+    coalesce_vars: Optional[List[str]] = None
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            self.__dict__[key] = value
+        self.subject_template = CompiledTemplate(self.subject)
+        self.body_template = CompiledTemplate(self.body)
+        self.variables = self.subject_template.variables | self.body_template.variables
+
+    def check(self) -> List[str]:
+        """Returns problems with the preset's declared template_vars, if it declares any."""
+        if self.template_vars is None:
+            return []
+        declared = set(self.template_vars)
+        problems = []
+        unknown = sorted(self.variables - declared)
+        if unknown:
+            problems.append(f"uses undeclared template_vars {unknown}")
+        unused = sorted(declared - self.variables)
+        if unused:
+            problems.append(f"declares template_vars {unused} that are not used in its subject or body")
+        return problems
+
+class SendConfig():
+    """The settings a send reads from its resource's config.
+
+    reconfigure builds a new SendConfig and swaps it in with a single assignment, and a send
+    reads it once when it starts, so a send in flight during a reconfigure finishes on the
+    settings it started with.
+    """
+    presets: Dict[str, Preset]
+    preset_configs: Dict[str, Mapping[str, Any]]
+    enforce_preset: bool = False
+    from_email: str = ""
+    from_email_name: str = ""
+    max_concurrent_sends: int = DEFAULT_MAX_CONCURRENT_SENDS
+    send_semaphore: asyncio.Semaphore
+    send_timeout: float = DEFAULT_SEND_TIMEOUT
+    max_retries: int = DEFAULT_MAX_RETRIES
+    retry_base_delay: float = DEFAULT_RETRY_BASE_DELAY
+    retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY
+    attachment_dirs: Optional[List[str]] = None
 
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
@@ -32,11 +113,41 @@ class Preset():
 class sendgridEmail(Generic, Reconfigurable):
 
     MODEL: ClassVar[Model] = Model(ModelFamily("viam-soleng", "messaging"), "sendgrid-email")
-    email_client: SendGridAPIClient
-    from_email: str
-    from_email_name: str
-    preset_messages: dict = {}
-    enforce_preset: bool
+    send_config: Optional[SendConfig]
+    key_pool: Optional[KeyPool]
+    rate_limiter: Optional[TokenBucket]
+    coalescer: Optional[Coalescer]
+    attachment_cache: Optional[AttachmentCache]
+    stats: Optional[Stats]
+    stats_exporter: Optional[PrometheusExporter]
+    spool: Optional[Spool]
+    queue_worker: Optional[QueueWorker]
+    breaker: Optional[CircuitBreaker]
+    spill: Optional[Spool]
+    spill_worker: Optional[QueueWorker]
+    delivery_log: Optional[DeliveryLog]
+    scheduler: Optional[Scheduler]
+    render_cache: Optional[RenderCache]
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        # several resources can run in one module, so all state lives on the instance
+        self.send_config = None
+        self.key_pool = None
+        self.rate_limiter = None
+        self.coalescer = None
+        self.attachment_cache = None
+        self.stats = None
+        self.stats_exporter = None
+        self.spool = None
+        self.queue_worker = None
+        self.breaker = None
+        self.spill = None
+        self.spill_worker = None
+        self.delivery_log = None
+        self.scheduler = None
+        self.render_cache = None
+        self.background: set = set()
 
     # Constructor
     @classmethod
@@ -49,32 +160,1040 @@ class sendgridEmail(Generic, Reconfigurable):
     @classmethod
     def validate(cls, config: ComponentConfig):
         api_key = config.attributes.fields["api_key"].string_value
-        if api_key == "":
+        api_keys = struct_to_dict(config.attributes).get("api_keys")
+        transport = struct_to_dict(config.attributes).get("transport") or "sendgrid"
+        if transport not in TRANSPORTS:
+            raise Exception(f"transport must be one of {list(TRANSPORTS)}")
+        # the memory transport needs no key, and an SMTP server may not ask for a password
+        if api_key == "" and not api_keys and transport == "sendgrid":
             raise Exception("An api_key must be defined")
-        
+        if api_keys is not None:
+            if not isinstance(api_keys, list):
+                raise Exception("api_keys must be a list")
+            for entry in api_keys:
+                if not isinstance(entry, dict) or not isinstance(entry.get("key"), str) or entry["key"] == "":
+                    raise Exception("each api_keys entry must define a key")
+                if entry.get("name") is not None and not isinstance(entry["name"], str):
+                    raise Exception("api_keys name must be a string")
+                validate_number(entry, "weight", 0, exclusive=True)
+                validate_number(entry, "rate_limit", 0, exclusive=True)
+                validate_number(entry, "rate_limit_burst", 1)
+
         enforce_preset = config.attributes.fields["enforce_preset"].bool_value
         if enforce_preset == True:
             attributes = struct_to_dict(config.attributes)
             preset_messages = attributes.get("preset_messages")
             if preset_messages is None:
                 raise Exception("preset_messages must be defined when enforce_preset is set to true")
+
+        attributes = struct_to_dict(config.attributes)
+        preset_messages = attributes.get("preset_messages") or {}
+        for name in preset_messages:
+            problems = Preset(**preset_messages[name]).check()
+            if problems:
+                raise Exception(f"preset_messages '{name}' " + "; ".join(problems))
+            validate_number(preset_messages[name], "coalesce_window", 0, exclusive=True)
+
+        validate_number(attributes, "max_concurrent_sends", 1)
+        validate_number(attributes, "send_timeout", 0, exclusive=True)
+        validate_number(attributes, "pool_size", 1)
+        validate_number(attributes, "pool_idle_timeout", 0)
+        validate_number(attributes, "rate_limit", 0, exclusive=True)
+        validate_number(attributes, "rate_limit_burst", 1)
+        validate_number(attributes, "key_eject_time", 0)
+        validate_number(attributes, "max_retries", 0)
+        validate_number(attributes, "retry_base_delay", 0, exclusive=True)
+        validate_number(attributes, "retry_max_delay", 0, exclusive=True)
+        validate_number(attributes, "coalesce_max_windows", 1)
+        validate_number(attributes, "attachment_cache_bytes", 0)
+        validate_number(attributes, "render_cache_bytes", 0)
+        validate_number(attributes, "stats_port", 1)
+        validate_number(attributes, "stats_interval", 0, exclusive=True)
+        validate_number(attributes, "status_capacity", 1)
+        validate_number(attributes, "status_ttl", 0, exclusive=True)
+        validate_number(attributes, "breaker_failure_rate", 0, exclusive=True)
+        if (attributes.get("breaker_failure_rate") or 0) > 1:
+            raise Exception("breaker_failure_rate must be at most 1")
+        validate_number(attributes, "breaker_min_requests", 1)
+        validate_number(attributes, "breaker_window", 0, exclusive=True)
+        validate_number(attributes, "breaker_open_time", 0, exclusive=True)
+        validate_number(attributes, "breaker_slow_call", 0, exclusive=True)
+        validate_number(attributes, "spill_concurrency", 1)
+        attachment_dirs = attributes.get("attachment_dirs")
+        if attachment_dirs is not None and (not isinstance(attachment_dirs, list) or not all(isinstance(d, str) for d in attachment_dirs)):
+            raise Exception("attachment_dirs must be a list of strings")
+        queue_path = attributes.get("queue_path")
+        if queue_path is not None and not isinstance(queue_path, str):
+            raise Exception("queue_path must be a string")
+        validate_number(attributes, "smtp_port", 1)
+        validate_number(attributes, "memory_capacity", 1)
+        for name in ("smtp_host", "smtp_username", "stats_host"):
+            if attributes.get(name) is not None and not isinstance(attributes[name], str):
+                raise Exception(f"{name} must be a string")
+        if attributes.get("smtp_security") is not None and attributes["smtp_security"] not in SMTP_SECURITY:
+            raise Exception(f"smtp_security must be one of {list(SMTP_SECURITY)}")
+        spill_path = attributes.get("spill_path")
+        if spill_path is not None and not isinstance(spill_path, str):
+            raise Exception("spill_path must be a string")
+        schedule_path = attributes.get("schedule_path")
+        if schedule_path is not None and not isinstance(schedule_path, str):
+            raise Exception("schedule_path must be a string")
         return
 
     # Handles attribute reconfiguration
     def reconfigure(self, config: ComponentConfig, dependencies: Mapping[ResourceName, ResourceBase]):
         attributes = struct_to_dict(config.attributes)
-        preset_messages = attributes.get("preset_messages") or {}
-        for p in preset_messages:
-            self.preset_messages[p] = Preset(**preset_messages[p])
+        previous = self.send_config
+
+        # only presets that were added or edited are recompiled
+        preset_configs = attributes.get("preset_messages") or {}
+        presets = {}
+        for name, preset_config in preset_configs.items():
+            if previous is not None and previous.preset_configs.get(name) == preset_config:
+                presets[name] = previous.presets[name]
+                continue
+            presets[name] = Preset(**preset_config)
+            if presets[name].variables:
+                LOGGER.debug(f"preset '{name}' expects template_vars {sorted(presets[name].variables)}")
+
+        # sends already waiting on the semaphore keep their place unless the limit changed
+        max_concurrent_sends = int(attributes.get("max_concurrent_sends") or DEFAULT_MAX_CONCURRENT_SENDS)
+        if previous is not None and previous.max_concurrent_sends == max_concurrent_sends:
+            send_semaphore = previous.send_semaphore
+        else:
+            send_semaphore = asyncio.Semaphore(max_concurrent_sends)
 
-        self.enforce_preset = config.attributes.fields["enforce_preset"].bool_value or False
-        self.from_email = config.attributes.fields["default_from"].string_value or ""
-        self.from_email_name = config.attributes.fields["default_from_name"].string_value or ""
+        max_retries = attributes.get("max_retries")
+        attachment_dirs = attributes.get("attachment_dirs")
+        self.send_config = SendConfig(
+            presets=presets,
+            preset_configs=preset_configs,
+            enforce_preset=config.attributes.fields["enforce_preset"].bool_value or False,
+            from_email=config.attributes.fields["default_from"].string_value or "",
+            from_email_name=config.attributes.fields["default_from_name"].string_value or "",
+            max_concurrent_sends=max_concurrent_sends,
+            send_semaphore=send_semaphore,
+            send_timeout=float(attributes.get("send_timeout") or DEFAULT_SEND_TIMEOUT),
+            max_retries=int(DEFAULT_MAX_RETRIES if max_retries is None else max_retries),
+            retry_base_delay=float(attributes.get("retry_base_delay") or DEFAULT_RETRY_BASE_DELAY),
+            retry_max_delay=float(attributes.get("retry_max_delay") or DEFAULT_RETRY_MAX_DELAY),
+            attachment_dirs=[os.path.realpath(d) for d in attachment_dirs] if attachment_dirs is not None else None,
+        )
 
+        if self.stats is None:
+            self.stats = Stats()
+        stats_file = attributes.get("stats_file") or None
+        stats_port = int(attributes["stats_port"]) if attributes.get("stats_port") else None
+        stats_interval = float(attributes.get("stats_interval") or 15)
+        stats_host = attributes.get("stats_host") or DEFAULT_STATS_HOST
+        if self.stats_exporter is not None and not self.stats_exporter.matches(stats_file, stats_port, stats_interval, stats_host):
+            self._run_soon(self.stats_exporter.stop())
+            self.stats_exporter = None
+        if self.stats_exporter is None and (stats_file is not None or stats_port is not None):
+            self.stats_exporter = PrometheusExporter(self._stats_snapshot, stats_file, stats_port, stats_interval, stats_host)
+            self._run_soon(self.stats_exporter.start())
+
+        # the limiter also carries any Retry-After pause, so keep it while its settings are unchanged
+        rate_limit = attributes.get("rate_limit")
+        rate_limit_burst = attributes.get("rate_limit_burst")
+        if self.rate_limiter is None or not self.rate_limiter.matches(rate_limit, rate_limit_burst):
+            self.rate_limiter = TokenBucket(rate_limit, rate_limit_burst)
+
+        # each key keeps its transport (and its warm connections), rate budget and health
+        # across reconfigures unless a setting it depends on changed
         api_key = config.attributes.fields["api_key"].string_value
-        self.email_client = SendGridAPIClient(api_key)
+        transport_name = attributes.get("transport") or "sendgrid"
+        transport_settings = self._transport_settings(transport_name, attributes)
+        close_delay = previous.send_timeout if previous is not None else self.send_config.send_timeout
+        key_configs = list(attributes.get("api_keys") or [])
+        if api_key != "":
+            key_configs.insert(0, {"key": api_key})
+        if not key_configs:
+            key_configs.append({"key": "", "name": transport_name})
+        previous_keys = {key.key: key for key in self.key_pool.keys} if self.key_pool is not None else {}
+        keys = []
+        for key_config in key_configs:
+            key = previous_keys.pop(key_config["key"], None)
+            if key is None or not key.transport.matches(transport_name, key_config["key"], transport_settings):
+                transport = self._new_transport(transport_name, key_config["key"], transport_settings)
+                if key is None:
+                    key = ApiKey(key_config["key"], "", 1.0, transport, TokenBucket())
+                else:
+                    self._close_client_later(key.transport, close_delay)
+                    key.transport = transport
+            key.name = key_config.get("name") or f"...{key_config['key'][-4:]}"
+            key.weight = float(key_config.get("weight") or 1.0)
+            if not key.rate_limiter.matches(key_config.get("rate_limit"), key_config.get("rate_limit_burst")):
+                key.rate_limiter = TokenBucket(key_config.get("rate_limit"), key_config.get("rate_limit_burst"))
+            keys.append(key)
+        for key in previous_keys.values():
+            self._close_client_later(key.transport, close_delay)
+        key_eject_time = attributes.get("key_eject_time")
+        self.key_pool = KeyPool(keys, float(DEFAULT_KEY_EJECT_TIME if key_eject_time is None else key_eject_time))
+
+        attachment_cache_bytes = attributes.get("attachment_cache_bytes")
+        attachment_cache_bytes = int(DEFAULT_CACHE_BYTES if attachment_cache_bytes is None else attachment_cache_bytes)
+        if self.attachment_cache is None:
+            self.attachment_cache = AttachmentCache(attachment_cache_bytes)
+        self.attachment_cache.resize(attachment_cache_bytes)
+
+        render_cache_bytes = attributes.get("render_cache_bytes")
+        render_cache_bytes = int(DEFAULT_RENDER_CACHE_BYTES if render_cache_bytes is None else render_cache_bytes)
+        if self.render_cache is None:
+            self.render_cache = RenderCache(render_cache_bytes)
+        self.render_cache.resize(render_cache_bytes)
+        if previous is not None:
+            self.render_cache.invalidate(name for name in previous.presets if presets.get(name) is not previous.presets[name])
+
+        status_capacity = int(attributes.get("status_capacity") or DEFAULT_STATUS_CAPACITY)
+        if self.delivery_log is None:
+            self.delivery_log = DeliveryLog(status_capacity)
+        self.delivery_log.resize(status_capacity)
+        self.delivery_log.ttl = float(attributes.get("status_ttl") or DEFAULT_STATUS_TTL)
+
+        coalesce_max_windows = int(attributes.get("coalesce_max_windows") or DEFAULT_MAX_WINDOWS)
+        if self.coalescer is None:
+            self.coalescer = Coalescer(self._send_digest, coalesce_max_windows)
+        self.coalescer.max_windows = coalesce_max_windows
+
+        if attributes.get("queue"):
+            queue_path = attributes.get("queue_path") or os.path.join(MODULE_DATA_DIR, f"{config.name}-outbox.sqlite3")
+            if self.spool is None or self.spool.path != queue_path:
+                self._stop_worker(self.queue_worker, self.spool)
+                self.spool = Spool(queue_path)
+                self.queue_worker = QueueWorker(
+                    self.spool,
+                    self._send_when_allowed,
+                    self.send_config.max_concurrent_sends,
+                    is_permanent=self._is_permanent_error,
+                    on_done=self._queued_done,
+                )
+            self.queue_worker.concurrency = self.send_config.max_concurrent_sends
+        else:
+            self._stop_worker(self.queue_worker, self.spool)
+            self.queue_worker, self.spool = None, None
+
+        # the breaker keeps its state across reconfigures unless its settings changed
+        if attributes.get("circuit_breaker", True):
+            breaker_settings = (
+                float(attributes.get("breaker_failure_rate") or DEFAULT_FAILURE_RATE),
+                int(attributes.get("breaker_min_requests") or DEFAULT_MIN_REQUESTS),
+                float(attributes.get("breaker_window") or DEFAULT_WINDOW),
+                float(attributes.get("breaker_open_time") or DEFAULT_OPEN_TIME),
+                float(attributes["breaker_slow_call"]) if attributes.get("breaker_slow_call") else None,
+            )
+            if self.breaker is None or not self.breaker.matches(*breaker_settings):
+                self.breaker = CircuitBreaker(*breaker_settings)
+        else:
+            self.breaker = None
+
+        # messages refused by an open circuit are spilled to disk and replayed once it closes
+        if attributes.get("spill") and self.breaker is not None:
+            spill_path = attributes.get("spill_path") or os.path.join(MODULE_DATA_DIR, f"{config.name}-spill.sqlite3")
+            spill_concurrency = int(attributes.get("spill_concurrency") or DEFAULT_SPILL_CONCURRENCY)
+            if self.spill is None or self.spill.path != spill_path:
+                self._stop_worker(self.spill_worker, self.spill)
+                self.spill = Spool(spill_path)
+                self.spill_worker = QueueWorker(
+                    self.spill,
+                    self._send_when_allowed,
+                    spill_concurrency,
+                    is_permanent=self._is_permanent_error,
+                    on_done=self._queued_done,
+                )
+            self.spill_worker.concurrency = spill_concurrency
+        else:
+            self._stop_worker(self.spill_worker, self.spill)
+            self.spill_worker, self.spill = None, None
+
+        schedule_path = attributes.get("schedule_path") or os.path.join(MODULE_DATA_DIR, f"{config.name}-schedule.sqlite3")
+        if self.scheduler is None or self.scheduler.path != schedule_path:
+            if self.scheduler is not None:
+                self._run_soon(self.scheduler.stop())
+            self.scheduler = Scheduler(schedule_path, self._send_scheduled)
+        self._start_background()
         return
+
+    @staticmethod
+    def _transport_settings(name: str, attributes: Mapping[str, Any]) -> Dict[str, Any]:
+        if name == "memory":
+            return {"capacity": int(attributes.get("memory_capacity") or DEFAULT_MEMORY_CAPACITY)}
+        pool_idle_timeout = attributes.get("pool_idle_timeout")
+        settings = {
+            "pool_size": int(attributes.get("pool_size") or DEFAULT_POOL_SIZE),
+            "pool_idle_timeout": float(DEFAULT_POOL_IDLE_TIMEOUT if pool_idle_timeout is None else pool_idle_timeout),
+        }
+        if name == "smtp":
+            from .smtp import SMTP_HOST, DEFAULT_SMTP_USERNAME
+            smtp_username = attributes.get("smtp_username")
+            return {
+                "host": attributes.get("smtp_host") or SMTP_HOST,
+                "port": int(attributes["smtp_port"]) if attributes.get("smtp_port") else None,
+                "username": DEFAULT_SMTP_USERNAME if smtp_username is None else smtp_username,
+                "security": attributes.get("smtp_security") or "starttls",
+                **settings,
+            }
+        return {"host": attributes.get("api_host") or SENDGRID_API_HOST, **settings, "http2": bool(attributes.get("http2") or False)}
+
+    @staticmethod
+    def _new_transport(name: str, api_key: str, settings: Mapping[str, Any]) -> Transport:
+        if name == "smtp":
+            from .smtp import SMTPTransport
+            return SMTPTransport(api_key, **settings)
+        if name == "memory":
+            return MemoryTransport(api_key, **settings)
+        return SendGridTransport(api_key, **settings)
+
+    @staticmethod
+    def _run_soon(coro):
+        try:
+            asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+
+    def _start_background(self):
+        """Starts the queue and spill workers and the scheduler, so spooled and scheduled messages left from a previous run are sent.
+
+        reconfigure can run before there is an event loop, so do_command calls this too.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for worker in (self.queue_worker, self.spill_worker):
+            if worker is not None:
+                worker.start()
+        self.scheduler.start()
+
+    @staticmethod
+    def _stop_worker(worker: Optional[QueueWorker], spool: Optional[Spool]):
+        if spool is None:
+            return
+
+        async def stop():
+            await worker.stop()
+            spool.close()
+        try:
+            asyncio.get_running_loop().create_task(stop())
+        except RuntimeError:
+            spool.close()
+
+    @staticmethod
+    def _is_permanent_error(e: Exception) -> bool:
+        # a rejected request will be rejected again; rate limits and timeouts are worth retrying
+        return isinstance(e, SendError) and 400 <= e.status_code < 500 and e.status_code not in (408, 429)
+
+    @staticmethod
+    def _error_text(e: Exception) -> str:
+        if isinstance(e, asyncio.TimeoutError):
+            return "send timed out"
+        return str(e) or type(e).__name__
+
+    def _record(self, message_id: str) -> Optional[DeliveryRecord]:
+        # the later requests of a split background send are spooled as <id>/<n>, under the record for <id>
+        return self.delivery_log.get(message_id.partition("/")[0])
+
+    def _queued_done(self, message_id: str, response: Any, error: Optional[Exception]):
+        record = self._record(message_id)
+        if record is None:
+            return
+        if error is None:
+            record.sent(response)
+        else:
+            record.failed(self._error_text(error))
+
+    @staticmethod
+    def _close_client_later(client: Transport, delay: float):
+        # give sends already using the old pool time to finish before closing it
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_later(delay, lambda: asyncio.ensure_future(client.close()))
+
+    async def close(self):
+        if self.scheduler is not None:
+            await self.scheduler.stop()
+            self.scheduler = None
+        if self.background:
+            # give messages accepted with async a chance to go out before the pool closes
+            _, pending = await asyncio.wait(self.background, timeout=self.send_config.send_timeout)
+            for task in pending:
+                task.cancel()
+        if self.stats_exporter is not None:
+            await self.stats_exporter.stop()
+            self.stats_exporter = None
+        if self.coalescer is not None:
+            await self.coalescer.close()
+        if self.queue_worker is not None:
+            await self.queue_worker.stop()
+            self.spool.close()
+            self.queue_worker, self.spool = None, None
+        if self.spill_worker is not None:
+            await self.spill_worker.stop()
+            self.spill.close()
+            self.spill_worker, self.spill = None, None
+        if self.key_pool is not None:
+            for key in self.key_pool.keys:
+                await key.transport.close()
+            self.key_pool = None
+
+    async def _send(self, payload: Mapping[str, Any], timeout: Optional[float] = None):
+        """Sends a payload within the rate limits, retrying 429s, 5xxs and connection failures.
+
+        Retries wait out the server's Retry-After or X-RateLimit-Reset when given, and jittered
+        exponential backoff otherwise, without holding a concurrency slot while waiting. A
+        401, 403 or 429 ejects the key that got it, and the send moves straight to another key
+        when another one is healthy. The send keeps the config it started with; each attempt uses the
+        current keys. Raises CircuitOpenError, without making a request, while the circuit
+        breaker is open.
+        """
+        config = self.send_config
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            key = self.key_pool.select()
+            try:
+                response = await self._attempt(key, payload, config, deadline)
+            except CircuitOpenError:
+                self.stats.count("breaker_rejected")
+                raise
+            except Exception as e:
+                error = e
+            else:
+                key.sent += 1
+                self.stats.count(f"status_{response.status_code}")
+                return response
+            key.failed += 1
+            if isinstance(error, SendError):
+                key.last_error = error.status_code
+                self.stats.count(f"status_{error.status_code}")
+            else:
+                self.stats.count(f"error_{type(error).__name__}")
+
+            delay = server_delay(error.headers) if isinstance(error, SendError) else None
+            failover = False
+            if isinstance(error, SendError) and error.status_code in KEY_ERROR_STATUSES:
+                self.key_pool.eject(key, delay if error.status_code == 429 else None)
+                # only another key is worth moving straight to; the same key waits out its delay
+                failover = self.key_pool.healthy(other_than=key)
+            if attempt >= config.max_retries or not (failover or is_retryable(error)):
+                raise error
+            attempt += 1
+            if failover:
+                self.stats.count("key_failovers")
+                LOGGER.warning(f"Failed to send email with key {key.name}, trying another key (attempt {attempt} of {config.max_retries}): {error}")
+                continue
+
+            if delay is None:
+                delay = backoff_delay(attempt - 1, config.retry_base_delay, config.retry_max_delay)
+            elif delay > config.retry_max_delay:
+                raise error
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise error
+            if isinstance(error, SendError) and error.status_code == 429:
+                # every send on this key shares its account's limit, so hold them all back
+                key.rate_limiter.pause(delay)
+            self.stats.count("retries")
+            LOGGER.warning(f"Failed to send email, retrying in {delay:.2f}s (attempt {attempt} of {config.max_retries}): {error}")
+            await asyncio.sleep(delay)
+
+    async def _attempt(self, key: ApiKey, payload: Mapping[str, Any], config: SendConfig, deadline: Optional[float]):
+        """Makes one request with the given key once the rate limits and a concurrency slot allow it."""
+        key.in_flight += 1
+        try:
+            self.stats.gauge("waiting", 1)
+            try:
+                await self.rate_limiter.acquire()
+                await key.rate_limiter.acquire()
+                await config.send_semaphore.acquire()
+            finally:
+                self.stats.gauge("waiting", -1)
+            # checked once a slot is held, so sends that queued up before the circuit opened fail fast too
+            breaker = self.breaker
+            if breaker is not None and not breaker.allow():
+                config.send_semaphore.release()
+                raise CircuitOpenError()
+            send_timeout = config.send_timeout
+            if deadline is not None:
+                send_timeout = min(send_timeout, deadline - time.monotonic())
+
+            key.requests += 1
+            self.stats.gauge("in_flight", 1)
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(key.transport.send(payload), send_timeout)
+            except Exception as e:
+                if breaker is not None:
+                    breaker.record(not is_outage(e), time.perf_counter() - start)
+                raise
+            except BaseException:
+                if breaker is not None:
+                    breaker.abandon()
+                raise
+            finally:
+                self.stats.observe("http", time.perf_counter() - start)
+                self.stats.gauge("in_flight", -1)
+                config.send_semaphore.release()
+            if breaker is not None:
+                breaker.record(True, time.perf_counter() - start)
+            return response
+        finally:
+            key.in_flight -= 1
+
+    async def _send_when_allowed(self, payload: Mapping[str, Any]):
+        """Sends a queued or spilled payload, waiting out an open circuit instead of using up its attempts."""
+        while True:
+            if self.breaker is not None:
+                await self.breaker.wait()
+            try:
+                return await self._send(payload)
+            except CircuitOpenError:
+                # another send took the half-open probe, or the circuit opened again
+                continue
+
+    async def _enqueue(self, spool: Spool, worker: QueueWorker, payload: Mapping[str, Any], message_id: Optional[str] = None) -> str:
+        """Spools a payload for a worker, recording it as pending until the worker is done with it."""
+        message_id = message_id or uuid.uuid4().hex
+        record = self._record(message_id) or self.delivery_log.add(message_id)
+        try:
+            await asyncio.to_thread(spool.put, payload, message_id)
+        except Exception as e:
+            record.failed(self._error_text(e))
+            raise
+        worker.start()
+        worker.notify()
+        return message_id
+
+    async def _spill(self, payload: Mapping[str, Any], message_id: Optional[str] = None) -> str:
+        message_id = await self._enqueue(self.spill, self.spill_worker, payload, message_id)
+        self.stats.count("spilled")
+        return message_id
+
+    def _split(self, payload: Mapping[str, Any]) -> List[PreparedPayload]:
+        """Checks a payload against SendGrid's request limits, splitting it into compliant requests if needed."""
+        start = time.perf_counter()
+        requests = split_payload(payload, MAX_RECIPIENTS, MAX_PERSONALIZATIONS, MAX_MESSAGE_SIZE)
+        self.stats.observe("preflight", time.perf_counter() - start)
+        if len(requests) > 1:
+            self.stats.count("split_sends")
+            self.stats.count("split_requests", len(requests))
+        return requests
+
+    async def _deliver(self, payload: Mapping[str, Any], timeout: Optional[float]) -> Mapping[str, ValueTypes]:
+        """Sends a payload, splitting it first if it is over SendGrid's request limits.
+
+        The requests of a split payload are delivered concurrently, and their results are
+        returned as results, one per request with the addresses it went to; status_code is
+        set when every request was accepted, and error otherwise.
+        """
+        try:
+            requests = self._split(payload)
+        except ValueError as e:
+            return {"error": str(e)}
+        if len(requests) == 1:
+            return await self._deliver_request(requests[0], timeout)
+        results = await asyncio.gather(*[self._deliver_request(request, timeout) for request in requests])
+        merged = {
+            "requests": len(requests),
+            "results": [
+                {"to": [entry["email"] for personalization in request["personalizations"] for entry in personalization["to"]], **result}
+                for request, result in zip(requests, results)
+            ],
+        }
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            merged["error"] = f"{len(errors)} of {len(requests)} requests failed: {errors[0]}"
+        elif all("status_code" in result for result in results):
+            merged["status_code"] = results[0]["status_code"]
+        return merged
+
+    async def _deliver_request(self, payload: Mapping[str, Any], timeout: Optional[float]) -> Mapping[str, ValueTypes]:
+        """Sends one request, or spools it for the queue worker when the queue is enabled.
+
+        While the circuit breaker is open the send fails fast, or is spilled for replay when
+        spill is enabled.
+        """
+        if self.spool is not None:
+            try:
+                message_id = await self._enqueue(self.spool, self.queue_worker, payload)
+            except Exception as e:
+                LOGGER.error(f"Failed to queue email: {e}")
+                return {"error": str(e)}
+            return {"message_id": message_id}
+
+        try:
+            response = await self._send(payload, timeout)
+            return {"status_code": response.status_code}
+        except CircuitOpenError as e:
+            if self.spill is None:
+                return {"error": str(e)}
+            try:
+                message_id = await self._spill(payload)
+            except Exception as e:
+                LOGGER.error(f"Failed to spill email: {e}")
+                return {"error": str(e)}
+            return {"message_id": message_id, "spilled": True}
+        except asyncio.TimeoutError:
+            LOGGER.error("Failed to send email: timed out")
+            return {"error": "send timed out"}
+        except Exception as e:
+            LOGGER.error(f"Failed to send email: {e}")
+            return {"error": str(e)}
     
+    @staticmethod
+    def _templates(command: Mapping[str, ValueTypes], config: SendConfig) -> Tuple[CompiledTemplate, CompiledTemplate, Optional[Preset]]:
+        """Returns the (subject, body) templates for a send, from its preset or its own subject and body."""
+        if 'preset' in command:
+            if command['preset'] not in config.presets:
+                raise ValueError(f"unknown preset '{command['preset']}'")
+            preset = config.presets[command['preset']]
+            return preset.subject_template, preset.body_template, preset
+        return CompiledTemplate(command.get('subject') or ""), CompiledTemplate(command.get('body') or ""), None
+
+    def _check_template_vars(self, command: Mapping[str, ValueTypes], preset: Optional[Preset], template_vars: Mapping[str, Any]):
+        # presets are configured ahead of time, so a missing value is a caller error rather than
+        # something to send through as a literal <<placeholder>>
+        if preset is not None:
+            missing = sorted(preset.variables.difference(template_vars))
+            if missing:
+                raise ValueError(f"missing template_vars {missing} for preset '{command['preset']}'")
+
+    def _render_content(self, command: Mapping[str, ValueTypes], config: SendConfig) -> Tuple[str, str, Optional[Preset]]:
+        """Returns the rendered (subject, html body) for a send, and its preset if it uses one."""
+        subject_template, body_template, preset = self._templates(command, config)
+        template_vars = command.get('template_vars') or {}
+        self._check_template_vars(command, preset, template_vars)
+        return subject_template.render(template_vars), body_template.render(template_vars), preset
+
+    @staticmethod
+    def _sender(command: Mapping[str, ValueTypes], config: SendConfig):
+        from_name = config.from_email_name
+        if "from_name" in command:
+            from_name = command["from_name"]
+
+        from_email = command['from'] if "from" in command else config.from_email
+        if from_name != "":
+            from sendgrid.helpers.mail import Email
+            return Email(email=from_email, name=from_name)
+        return from_email
+
+    async def _load_attachments(self, command: Mapping[str, ValueTypes], config: SendConfig) -> List[Tuple[str, str, str]]:
+        """Returns (base64 content, filename, mime type) for each attachment, reading any given by path.
+
+        Sizes are checked against SendGrid's message limit before any file is read or encoded.
+        """
+        attachments = command.get('attachments') or []
+        total_size = 0
+        # the resolved path is both checked and read, so a symlink swapped in between cannot escape attachment_dirs
+        paths = []
+        for att in attachments:
+            path = None
+            if att.get('path'):
+                # any file the module can read would otherwise be mailable by any caller
+                if config.attachment_dirs is None:
+                    raise ValueError("attachments given by path are not allowed unless attachment_dirs is configured")
+                path = os.path.realpath(att['path'])
+                if not any(os.path.commonpath([path, d]) == d for d in config.attachment_dirs):
+                    raise ValueError(f"attachment path '{att['path']}' is not in an allowed attachment_dirs directory")
+                if not os.path.isfile(path):
+                    raise ValueError(f"attachment path '{att['path']}' is not a file")
+                total_size += encoded_size(os.path.getsize(path))
+            else:
+                total_size += len(att.get('content', ''))
+            paths.append(path)
+        if total_size > MAX_MESSAGE_SIZE:
+            raise ValueError(f"attachments total {total_size} bytes encoded, over SendGrid's {MAX_MESSAGE_SIZE} byte message limit")
+
+        if not attachments:
+            return []
+        start = time.perf_counter()
+        loaded = []
+        for att, path in zip(attachments, paths):
+            if path is not None:
+                content = await asyncio.to_thread(self.attachment_cache.load, path)
+                filename = att.get('filename') or os.path.basename(path)
+                mime_type = att.get('mime_type') or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            else:
+                content = att.get('content', '')
+                filename = att.get('filename', 'attachment')
+                mime_type = att.get('mime_type', 'application/octet-stream')
+            loaded.append((content, filename, mime_type))
+        self.stats.observe("attachments", time.perf_counter() - start)
+        return loaded
+
+    def _add_attachments(self, message: "Mail", attachments: List[Tuple[str, str, str]]):
+        from sendgrid.helpers.mail import Attachment, FileContent, FileName, FileType, Disposition
+        for content, filename, mime_type in attachments:
+            attachment = Attachment()
+            attachment.file_content = FileContent(content)
+            attachment.file_name = FileName(filename)
+            attachment.file_type = FileType(mime_type)
+            attachment.disposition = Disposition('attachment')
+            message.add_attachment(attachment)
+
+    async def _send_email(self, command: Mapping[str, ValueTypes], timeout: Optional[float]) -> Mapping[str, ValueTypes]:
+        config = self.send_config
+        if config.enforce_preset and not "preset" in command:
+            return { "error" : "preset message must be specified" }
+        if not 'to' in command:
+            return { "error": "'to' must be defined" }
+
+        start = time.perf_counter()
+        cache_key = self._render_cache_key(command, config)
+        rendered = self.render_cache.get(cache_key, config.presets.get(command['preset'])) if cache_key is not None else None
+        if rendered is not None:
+            subject, html_content, preset = rendered.subject, rendered.html_content, rendered.preset
+        else:
+            try:
+                subject, html_content, preset = self._render_content(command, config)
+            except ValueError as e:
+                return {"error": str(e)}
+        self.stats.observe("render", time.perf_counter() - start)
+
+        if 'send_at' in command:
+            return await self._schedule(command, subject, html_content)
+
+        coalesce = None
+        if preset is not None and preset.coalesce_window:
+            key = self._coalesce_key(command, preset)
+            window, repeat = self.coalescer.offer(key, preset.coalesce_window, command, subject, html_content)
+            if repeat:
+                suppressed = window.suppressed
+                # a repeat of a message still being sent is only suppressed once that send succeeds
+                error = await asyncio.shield(window.first)
+                if error is not None:
+                    return {"error": error}
+                return {"coalesced": True, "suppressed": suppressed}
+            coalesce = (key, window)
+
+        if command.get('async'):
+            message_id = uuid.uuid4().hex
+            record = self.delivery_log.add(message_id)
+            task = asyncio.create_task(
+                self._send_in_background(command, subject, html_content, config, message_id, record, cache_key, rendered, coalesce)
+            )
+            self.background.add(task)
+            task.add_done_callback(self.background.discard)
+            return {"message_id": message_id}
+
+        result = {"error": "send cancelled"}
+        try:
+            try:
+                payload = await self._message_payload(command, subject, html_content, config, cache_key, rendered)
+            except (ValueError, OSError) as e:
+                result = {"error": str(e)}
+            else:
+                result = await self._deliver(payload, timeout)
+        finally:
+            if coalesce is not None:
+                self._coalesce_done(coalesce, result.get("error"))
+        return result
+
+    def _coalesce_done(self, coalesce: Tuple[Tuple, CoalesceWindow], error: Optional[str]):
+        key, window = coalesce
+        if error is None:
+            self.coalescer.first_sent(window)
+        else:
+            # nothing was sent for later repeats to be counted against
+            self.coalescer.first_failed(key, window, error)
+
+    async def _send_in_background(
+        self,
+        command: Mapping[str, ValueTypes],
+        subject: str,
+        html_content: str,
+        config: SendConfig,
+        message_id: str,
+        record: DeliveryRecord,
+        cache_key: Optional[Tuple] = None,
+        rendered: Optional[RenderedMessage] = None,
+        coalesce: Optional[Tuple[Tuple, CoalesceWindow]] = None,
+    ):
+        try:
+            try:
+                payload = await self._message_payload(command, subject, html_content, config, cache_key, rendered)
+                requests = self._split(payload)
+            except Exception as e:
+                LOGGER.error(f"Failed to send email {message_id}: {self._error_text(e)}")
+                record.failed(self._error_text(e))
+                requests = []
+            if len(requests) > 1:
+                record.split(len(requests))
+            await asyncio.gather(*[
+                self._send_request_in_background(request, message_id if n == 1 else f"{message_id}/{n}", record)
+                for n, request in enumerate(requests, 1)
+            ])
+        finally:
+            if coalesce is not None:
+                # a queued or spilled message counts as sent once it is accepted for delivery
+                self._coalesce_done(coalesce, record.error if record.state == FAILED else None)
+
+    async def _send_request_in_background(self, payload: Mapping[str, Any], message_id: str, record: DeliveryRecord):
+        try:
+            if self.spool is not None:
+                # the queue worker finishes the record once the message is delivered or dropped
+                await self._enqueue(self.spool, self.queue_worker, payload, message_id)
+                return
+            try:
+                response = await self._send(payload)
+            except CircuitOpenError:
+                if self.spill is None:
+                    raise
+                await self._spill(payload, message_id)
+                return
+        except Exception as e:
+            LOGGER.error(f"Failed to send email {message_id}: {self._error_text(e)}")
+            record.failed(self._error_text(e))
+            return
+        record.sent(response)
+
+    async def _schedule(self, command: Mapping[str, ValueTypes], subject: str, html_content: str) -> Mapping[str, ValueTypes]:
+        try:
+            send_at = parse_send_at(command['send_at'])
+        except ValueError as e:
+            return {"error": str(e)}
+        entry = {
+            "command": {key: value for key, value in command.items() if key not in ('command', 'send_at', 'async')},
+            "subject": subject,
+            "html_content": html_content,
+        }
+        try:
+            message_id = await self.scheduler.add(send_at, entry)
+        except Exception as e:
+            LOGGER.error(f"Failed to schedule email: {e}")
+            return {"error": str(e)}
+        self.delivery_log.add(message_id)
+        return {"message_id": message_id, "send_at": send_at}
+
+    async def _send_scheduled(self, message_id: str, entry: Mapping[str, Any]):
+        record = self.delivery_log.get(message_id) or self.delivery_log.add(message_id)
+        await self._send_in_background(entry["command"], entry["subject"], entry["html_content"], self.send_config, message_id, record)
+
+    async def _schedule_cancel(self, command: Mapping[str, ValueTypes]) -> Mapping[str, ValueTypes]:
+        if not command.get('id'):
+            return {"error": "'id' must be defined"}
+        cancelled = await self.scheduler.cancel(command['id'])
+        record = self.delivery_log.get(command['id'])
+        if cancelled and record is not None:
+            record.failed("cancelled")
+        return {"cancelled": cancelled}
+
+    def _schedule_list(self, command: Mapping[str, ValueTypes]) -> Mapping[str, ValueTypes]:
+        entries = self.scheduler.list()
+        if command.get('limit'):
+            entries = entries[:int(command['limit'])]
+        return {
+            "scheduled": [
+                {"id": message_id, "send_at": send_at, "to": entry["command"]["to"], "subject": entry["subject"]}
+                for message_id, send_at, entry in entries
+            ],
+            "total": len(self.scheduler),
+        }
+
+    def _status(self, command: Mapping[str, ValueTypes]) -> Mapping[str, ValueTypes]:
+        message_ids = command.get('ids') or ([command['id']] if command.get('id') else [])
+        if not message_ids:
+            return {"error": "'id' or 'ids' must be defined"}
+        messages = {}
+        for message_id in message_ids:
+            record = self.delivery_log.get(message_id)
+            messages[message_id] = record.to_dict() if record is not None else {"state": "unknown"}
+        return {"messages": messages}
+
+    def _render_cache_key(self, command: Mapping[str, ValueTypes], config: SendConfig) -> Optional[Tuple]:
+        # attachments are large and already cached by content, so only their message would be saved
+        if 'preset' not in command or command.get('attachments') or self.render_cache.max_bytes == 0:
+            return None
+        return (
+            command['preset'],
+            command['from'] if 'from' in command else config.from_email,
+            command['from_name'] if 'from_name' in command else config.from_email_name,
+            template_vars_digest(command.get('template_vars') or {}),
+        )
+
+    async def _message_payload(
+        self,
+        command: Mapping[str, ValueTypes],
+        subject: str,
+        html_content: str,
+        config: SendConfig,
+        cache_key: Optional[Tuple],
+        rendered: Optional[RenderedMessage],
+    ) -> Dict[str, Any]:
+        """Returns the payload for a send, splicing its recipients into a cached render when there is one."""
+        if rendered is not None:
+            start = time.perf_counter()
+            payload = rendered.payload(command['to'])
+            self.stats.observe("build", time.perf_counter() - start)
+            return payload
+        payload = await self._build_payload(command, subject, html_content, config)
+        if cache_key is None:
+            return payload
+        rendered = RenderedMessage(config.presets[command['preset']], subject, html_content, payload)
+        self.render_cache.put(cache_key, rendered)
+        # sent with the encoding just made for the cache, rather than serialized again
+        return rendered.payload(command['to'])
+
+    async def _build_payload(self, command: Mapping[str, ValueTypes], subject: str, html_content: str, config: SendConfig) -> Dict[str, Any]:
+        from sendgrid.helpers.mail import Mail
+        attachments = await self._load_attachments(command, config)
+        start = time.perf_counter()
+        message = Mail(
+            from_email=self._sender(command, config),
+            to_emails=command['to'],
+            subject=subject,
+            html_content=html_content,
+        )
+        self._add_attachments(message, attachments)
+        payload = message.get()
+        self.stats.observe("build", time.perf_counter() - start)
+        return payload
+
+    @staticmethod
+    def _coalesce_key(command: Mapping[str, ValueTypes], preset: Preset) -> Tuple:
+        to = command['to']
+        template_vars = command.get('template_vars') or {}
+        names = preset.coalesce_vars if preset.coalesce_vars is not None else sorted(template_vars)
+        return (
+            command['preset'],
+            (to,) if isinstance(to, str) else tuple(sorted(to)),
+            tuple(str(template_vars.get(name)) for name in names),
+        )
+
+    async def _send_digest(self, window: CoalesceWindow):
+        first_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(window.first_seen))
+        last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(window.last_seen))
+        subject = f"{window.subject} (repeated {window.suppressed} more time{'s' if window.suppressed != 1 else ''})"
+        html_content = (
+            f"<p>This message was repeated {window.suppressed} more time{'s' if window.suppressed != 1 else ''} "
+            f"after it was first sent at {first_seen} UTC; the last repeat was at {last_seen} UTC.</p>"
+            + window.html_content
+        )
+        result = await self._deliver(await self._build_payload(window.command, subject, html_content, self.send_config), None)
+        if "error" in result:
+            raise Exception(result["error"])
+
+    async def _send_batch(self, command: Mapping[str, ValueTypes], timeout: Optional[float]) -> Mapping[str, ValueTypes]:
+        """Sends one message to many recipients, each with its own template_vars.
+
+        Recipients are packed into SendGrid personalizations, as many per request as its
+        recipient, personalization and size limits allow, so a large fan-out costs a handful
+        of requests that are sent concurrently and share one encoding of the attachments.
+        Variables shared by every recipient are rendered once up front; per-recipient variables
+        are applied by SendGrid as substitutions in the body, while each recipient's subject is
+        rendered locally. A shared variable that any recipient overrides is left in the body
+        and substituted for every recipient, with the shared value for those that do not.
+        """
+        from sendgrid.helpers.mail import Mail, To
+        config = self.send_config
+        if config.enforce_preset and not "preset" in command:
+            return { "error" : "preset message must be specified" }
+        recipients = command.get('recipients') or []
+        if len(recipients) == 0:
+            return { "error": "'recipients' must be a non-empty list" }
+
+        start = time.perf_counter()
+        try:
+            subject_template, body_template, preset = self._templates(command, config)
+        except ValueError as e:
+            return {"error": str(e)}
+        shared_vars = command.get('template_vars') or {}
+        overridden = dict.fromkeys(key for recipient in recipients for key in (recipient.get('template_vars') or {}))
+        html_content = body_template.render({key: val for key, val in shared_vars.items() if key not in overridden})
+
+        personalizations = []
+        for recipient in recipients:
+            if not recipient.get('to'):
+                return { "error": "each recipient must define 'to'" }
+            to = recipient['to']
+            personalization = {"to": [To(email).get() for email in ([to] if isinstance(to, str) else to)]}
+            template_vars = recipient.get('template_vars') or {}
+            recipient_vars = {**shared_vars, **template_vars}
+            try:
+                self._check_template_vars(command, preset, recipient_vars)
+            except ValueError as e:
+                return {"error": str(e)}
+            personalization["subject"] = subject_template.render(recipient_vars)
+            substitutions = {f"<<{key}>>": str(recipient_vars[key]) for key in overridden if key in recipient_vars}
+            if substitutions:
+                personalization["substitutions"] = substitutions
+            personalizations.append(personalization)
+        self.stats.observe("render", time.perf_counter() - start)
+
+        try:
+            attachments = await self._load_attachments(command, config)
+        except (ValueError, OSError) as e:
+            return {"error": str(e)}
+        start = time.perf_counter()
+        message = Mail(from_email=self._sender(command, config), subject=subject_template.source, html_content=html_content)
+        self._add_attachments(message, attachments)
+        base_payload = message.get()
+        self.stats.observe("build", time.perf_counter() - start)
+
+        try:
+            requests = self._split({**base_payload, "personalizations": personalizations})
+        except ValueError as e:
+            return {"error": str(e)}
+        request_results = await asyncio.gather(*[self._deliver_request(request, timeout) for request in requests])
+
+        results = []
+        for request, request_result in zip(requests, request_results):
+            for personalization in request["personalizations"]:
+                results.append({"to": [to["email"] for to in personalization["to"]], **request_result})
+        return {"results": results}
+
+    def _stats_snapshot(self) -> Dict[str, Any]:
+        snapshot = self.stats.snapshot()
+        snapshot["counters"].update({f"coalesce_{name}": value for name, value in self.coalescer.stats().items()})
+        snapshot["counters"].update({f"attachment_cache_{name}": value for name, value in self.attachment_cache.stats().items()})
+        snapshot["counters"].update({f"render_cache_{name}": value for name, value in self.render_cache.stats().items() if name != "hit_ratio"})
+        if self.queue_worker is not None:
+            snapshot["counters"]["queue_delivered"] = self.queue_worker.delivered
+            snapshot["counters"]["queue_dropped"] = self.queue_worker.dropped
+            snapshot["gauges"]["queue_in_flight"] = len(self.queue_worker.inflight)
+        if self.spill_worker is not None:
+            snapshot["counters"]["spill_replayed"] = self.spill_worker.delivered
+            snapshot["counters"]["spill_dropped"] = self.spill_worker.dropped
+        if self.breaker is not None:
+            snapshot["counters"]["breaker_opens"] = self.breaker.opens
+            snapshot["gauges"]["breaker_open"] = int(self.breaker.state != "closed")
+        snapshot["gauges"]["scheduled"] = len(self.scheduler)
+        return snapshot
+
+    async def _get_stats(self, reset: bool) -> Mapping[str, ValueTypes]:
+        snapshot = self._stats_snapshot()
+        if self.spool is not None:
+            snapshot["gauges"]["queued"] = (await asyncio.to_thread(self.spool.status))["pending"]
+        if self.spill is not None:
+            snapshot["gauges"]["spilled"] = (await asyncio.to_thread(self.spill.status))["pending"]
+        if reset:
+            self.stats.reset()
+        return snapshot
+
+    async def _queue_status(self) -> Mapping[str, ValueTypes]:
+        status = await asyncio.to_thread(self.spool.status)
+        return {**status, "delivered": self.queue_worker.delivered, "dropped": self.queue_worker.dropped}
+
+    async def _breaker_status(self) -> Mapping[str, ValueTypes]:
+        status = self.breaker.status()
+        if self.spill is not None:
+            spill_status = await asyncio.to_thread(self.spill.status)
+            status["spill"] = {**spill_status, "replayed": self.spill_worker.delivered, "dropped": self.spill_worker.dropped}
+        return status
+
+    def _recorded_messages(self, command: Mapping[str, ValueTypes]) -> Mapping[str, ValueTypes]:
+        transports = [key.transport for key in self.key_pool.keys if isinstance(key.transport, MemoryTransport)]
+        if not transports:
+            return {"error": "transport is not memory"}
+        limit = command.get('limit')
+        messages = [message for transport in transports for message in transport.recorded(int(limit) if limit else None)]
+        result = {"count": sum(transport.count for transport in transports), "messages": messages}
+        if command.get('clear'):
+            for transport in transports:
+                transport.messages.clear()
+        return result
+
     async def do_command(
                 self,
                 command: Mapping[str, ValueTypes],
@@ -82,64 +1201,43 @@ class sendgridEmail(Generic, Reconfigurable):
                 timeout: Optional[float] = None,
                 **kwargs
             ) -> Mapping[str, ValueTypes]:
-        result = {}
-
+        self._start_background()
         if 'command' in command:
             if command['command'] == 'send':
-                message_args = {}
-                if self.enforce_preset and not "preset" in command:
-                    return { "error" : "preset message must be specified" }
-
-                if 'preset' in command:
-                    message_args['html_content'] = self.preset_messages[command['preset']].body
-                    message_args['subject'] = self.preset_messages[command['preset']].subject
-                else:
-                    message_args['html_content'] = command['body'] or ""
-                    message_args['subject'] = command['subject'] or ""
-                
-                # replace templated params
-                if 'template_vars' in command:
-                    for key, val in command['template_vars'].items():
-                        message_args['html_content'] = message_args['html_content'].replace(f"<<{key}>>", val)
-                        message_args['subject'] = message_args['subject'].replace(f"<<{key}>>", val)
-
-                if 'to' in command:
-                    message_args['to_emails'] = command['to']
-                else:
-                    return { "error": "'to' must be defined" }
-                
-                from_name = self.from_email_name
-                if "from_name" in command:
-                    from_name = command["from_name"]
-                
-                if "from" in command:
-                    if from_name != "":
-                        message_args['from_email'] = Email(email=command['from'], name=from_name)
-                    else:
-                        message_args['from_email'] = command['from']
-                else:
-                    if from_name != "":
-                        message_args['from_email'] = Email(email=self.from_email, name=from_name)
-                    else:
-                        message_args['from_email'] = self.from_email
-
-                message = Mail(**message_args)
-
-                # Handle attachments if provided
-                if 'attachments' in command:
-                    for att in command['attachments']:
-                        attachment = Attachment()
-                        attachment.file_content = FileContent(att.get('content', ''))
-                        attachment.file_name = FileName(att.get('filename', 'attachment'))
-                        attachment.file_type = FileType(att.get('mime_type', 'application/octet-stream'))
-                        attachment.disposition = Disposition('attachment')
-                        message.add_attachment(attachment)
-                
-                try:
-                    response = self.email_client.send(message)
-                    return {"status_code": response.status_code}
-                except Exception as e:
-                    LOGGER.error(f"Failed to send email: {e}")
-                    return {"error": str(e)}
+                return await self._send_email(command, timeout)
+            if command['command'] == 'send_batch':
+                return await self._send_batch(command, timeout)
+            if command['command'] == 'schedule_cancel':
+                return await self._schedule_cancel(command)
+            if command['command'] == 'schedule_list':
+                return self._schedule_list(command)
+            if command['command'] == 'status':
+                return self._status(command)
+            if command['command'] == 'get_stats':
+                return await self._get_stats(bool(command.get('reset')))
+            if command['command'] == 'recorded_messages':
+                return self._recorded_messages(command)
+            if command['command'] == 'key_status':
+                return {"keys": self.key_pool.stats()}
+            if command['command'] == 'breaker_status':
+                if self.breaker is None:
+                    return {"error": "circuit breaker is not enabled"}
+                return await self._breaker_status()
+            if command['command'] == 'render_cache_status':
+                return self.render_cache.stats()
+            if command['command'] == 'attachment_cache_status':
+                return self.attachment_cache.stats()
+            if command['command'] == 'coalesce_status':
+                return self.coalescer.stats()
+            if command['command'] == 'queue_status':
+                if self.spool is None:
+                    return {"error": "queue is not enabled"}
+                return await self._queue_status()
+            if command['command'] == 'queue_flush':
+                if self.spool is None:
+                    return {"error": "queue is not enabled"}
+                self.queue_worker.start()
+                flushed = await self.queue_worker.flush(command.get('timeout') or timeout)
+                return {"flushed": flushed, **(await self._queue_status())}
     
-        return {"error": "command must be defined"}
\ No newline at end of file
+        return {"error": "command must be defined"}
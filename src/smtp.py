@@ -0,0 +1,308 @@
+"""
+SMTP transport: delivers mail send payloads over pooled, authenticated SMTP connections.
+"""
+
+import asyncio
+import base64
+import re
+import socket
+import ssl
+import time
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+from email.utils import formataddr, formatdate, make_msgid
+from typing import Any, List, Mapping, Optional, Set, Tuple
+
+from .transport import DEFAULT_POOL_IDLE_TIMEOUT, DEFAULT_POOL_SIZE, SMTP_PORTS, SendError, Transport, TransportResponse
+
+SMTP_HOST = "smtp.sendgrid.net"
+# SendGrid's SMTP relay takes the literal user name "apikey" with an API key as the password
+DEFAULT_SMTP_USERNAME = "apikey"
+# base64 attachment bodies are wrapped to the line length MIME requires
+BASE64_LINE_LENGTH = 76
+# messages are kept to 7-bit so they need no 8BITMIME or SMTPUTF8 support from the server
+MESSAGE_POLICY = SMTP.clone(cte_type="7bit")
+DOT_AT_LINE_START = re.compile(rb"^\.", re.MULTILINE)
+
+
+class SMTPSendError(SendError):
+    """Raised when an SMTP server refuses a message, with smtp_code the server's reply.
+
+    Authentication failures are reported as 401 so the key is ejected, other transient
+    (4xx) replies and lost connections as 503 so the send is retried, and other permanent
+    (5xx) replies as 400.
+    """
+
+    def __init__(self, smtp_code: int, reply: str):
+        if smtp_code in (530, 534, 535):
+            status_code = 401
+        elif smtp_code < 500:
+            status_code = 503
+        else:
+            status_code = 400
+        super().__init__(status_code, f"SMTP Error {smtp_code}: {reply}")
+        self.smtp_code = smtp_code
+
+
+def _address(entry: Mapping[str, Any]) -> str:
+    return formataddr((entry.get("name") or "", entry["email"]))
+
+
+def _substitute(text: str, substitutions: Mapping[str, str]) -> str:
+    for key, value in substitutions.items():
+        text = text.replace(key, value)
+    return text
+
+
+def _attachment_parts(payload: Mapping[str, Any]) -> List[MIMEPart]:
+    """Returns a MIME part for each attachment, reusing its base64 content rather than decoding it."""
+    parts = []
+    for attachment in payload.get("attachments") or []:
+        content = attachment["content"]
+        part = MIMEPart(policy=MESSAGE_POLICY)
+        part["Content-Type"] = attachment.get("type") or "application/octet-stream"
+        part["Content-Disposition"] = f"{attachment.get('disposition') or 'attachment'}; filename=\"{attachment['filename']}\""
+        part["Content-Transfer-Encoding"] = "base64"
+        part.set_payload("\n".join(content[i:i + BASE64_LINE_LENGTH] for i in range(0, len(content), BASE64_LINE_LENGTH)) + "\n")
+        parts.append(part)
+    return parts
+
+
+def payload_messages(payload: Mapping[str, Any]) -> List[Tuple[str, List[str], bytes, str]]:
+    """Converts a mail send payload to (sender, recipients, message bytes, Message-ID), one per personalization.
+
+    Each personalization's subject and substitutions are applied as SendGrid would, and
+    its bcc recipients are added to the envelope only.
+    """
+    sender = payload["from"]
+    attachments = _attachment_parts(payload)
+    messages = []
+    for personalization in payload.get("personalizations") or []:
+        substitutions = personalization.get("substitutions") or {}
+        message = EmailMessage(policy=MESSAGE_POLICY)
+        message_id = make_msgid(domain=sender["email"].rpartition("@")[2] or "localhost")
+        message["From"] = _address(sender)
+        message["To"] = ", ".join(_address(to) for to in personalization.get("to") or [])
+        if personalization.get("cc"):
+            message["Cc"] = ", ".join(_address(cc) for cc in personalization["cc"])
+        if payload.get("reply_to"):
+            message["Reply-To"] = _address(payload["reply_to"])
+        message["Subject"] = _substitute(personalization.get("subject") or payload.get("subject") or "", substitutions)
+        message["Date"] = formatdate()
+        message["Message-ID"] = message_id
+
+        for i, content in enumerate(payload.get("content") or []):
+            subtype = content["type"].partition("/")[2] or "plain"
+            value = _substitute(content["value"], substitutions)
+            if i == 0:
+                message.set_content(value, subtype=subtype)
+            else:
+                message.add_alternative(value, subtype=subtype)
+        for part in attachments:
+            if not message.is_multipart() or message.get_content_subtype() != "mixed":
+                message.make_mixed()
+            message.attach(part)
+
+        recipients = [entry["email"] for field in ("to", "cc", "bcc") for entry in personalization.get(field) or []]
+        messages.append((sender["email"], recipients, message.as_bytes(), message_id))
+    return messages
+
+
+class SMTPConnection():
+    """One SMTP session, kept open between messages.
+
+    When the server offers PIPELINING, the envelope (MAIL, every RCPT and DATA) is sent in
+    one write and the replies read together, so each message costs two round trips.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.extensions: Set[str] = set()
+        self.last_used = time.monotonic()
+        self.used = False
+
+    @classmethod
+    async def open(
+        cls, host: str, port: int, security: str, username: str, password: str, context: Optional[ssl.SSLContext]
+    ) -> "SMTPConnection":
+        reader, writer = await asyncio.open_connection(host, port, ssl=context if security == "tls" else None)
+        connection = cls(reader, writer)
+        try:
+            await connection._expect(220)
+            await connection._ehlo()
+            if security == "starttls":
+                if "STARTTLS" not in connection.extensions:
+                    raise SMTPSendError(554, f"{host} does not offer STARTTLS")
+                await connection._command(b"STARTTLS", 220)
+                await writer.start_tls(context, server_hostname=host)
+                await connection._ehlo()
+            if username and password:
+                credentials = base64.b64encode(f"\0{username}\0{password}".encode("utf-8"))
+                await connection._command(b"AUTH PLAIN " + credentials, 235)
+        except BaseException:
+            connection.abort()
+            raise
+        return connection
+
+    async def _reply(self) -> Tuple[int, str]:
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line.endswith(b"\n"):
+                raise ConnectionError("SMTP server closed the connection")
+            lines.append(line[4:].strip().decode("utf-8", "replace"))
+            if line[3:4] != b"-":
+                return int(line[:3]), "\n".join(lines)
+
+    async def _expect(self, expected: int) -> List[str]:
+        code, reply = await self._reply()
+        if code != expected:
+            raise SMTPSendError(code, reply)
+        return reply.split("\n")
+
+    async def _command(self, command: bytes, expected: int) -> List[str]:
+        self.writer.write(command + b"\r\n")
+        await self.writer.drain()
+        return await self._expect(expected)
+
+    async def _ehlo(self):
+        lines = await self._command(b"EHLO " + socket.gethostname().encode("ascii", "replace"), 250)
+        self.extensions = {line.split(" ")[0].upper() for line in lines[1:]}
+
+    async def send(self, sender: str, recipients: List[str], message: bytes):
+        envelope = [f"MAIL FROM:<{sender}>".encode("utf-8")] + [f"RCPT TO:<{recipient}>".encode("utf-8") for recipient in recipients]
+        if "PIPELINING" in self.extensions:
+            self.writer.write(b"".join(command + b"\r\n" for command in envelope + [b"DATA"]))
+            await self.writer.drain()
+            replies = [await self._reply() for _ in range(len(envelope) + 1)]
+        else:
+            replies = []
+            for command in envelope + [b"DATA"]:
+                self.writer.write(command + b"\r\n")
+                await self.writer.drain()
+                replies.append(await self._reply())
+                if replies[-1][0] >= 400:
+                    break
+
+        refused = next(((code, reply) for code, reply in replies[:-1] if code >= 400), None)
+        data_code, data_reply = replies[-1]
+        if refused is not None or data_code != 354:
+            if data_code == 354:
+                # a message cannot be withdrawn once DATA is accepted, so drop the session instead
+                self.abort()
+            else:
+                await self._command(b"RSET", 250)
+            raise SMTPSendError(*(refused or (data_code, data_reply)))
+
+        self.writer.write(DOT_AT_LINE_START.sub(b"..", message))
+        self.writer.write(b".\r\n" if message.endswith(b"\r\n") else b"\r\n.\r\n")
+        await self.writer.drain()
+        await self._expect(250)
+        self.last_used = time.monotonic()
+        self.used = True
+
+    @property
+    def closed(self) -> bool:
+        return self.writer.is_closing()
+
+    def abort(self):
+        self.writer.close()
+
+    async def quit(self):
+        try:
+            await asyncio.wait_for(self._command(b"QUIT", 221), 1.0)
+        except Exception:
+            pass
+        self.abort()
+
+
+class SMTPTransport(Transport):
+    """Sends mail payloads over a pool of persistent SMTP connections.
+
+    Up to pool_size sessions are opened and authenticated on demand and kept between
+    messages, so a send reuses a warm, authenticated connection; sessions idle for longer
+    than pool_idle_timeout are closed. A payload with several personalizations is sent
+    as one message per personalization on the same session. The send is answered with a
+    202 once the server accepts every message.
+    """
+
+    name = "smtp"
+
+    def __init__(
+        self,
+        api_key: str,
+        host: str = SMTP_HOST,
+        port: Optional[int] = None,
+        username: str = DEFAULT_SMTP_USERNAME,
+        security: str = "starttls",
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+    ):
+        self.api_key = api_key
+        self.host = host
+        self.port = port or SMTP_PORTS[security]
+        self.username = username
+        self.security = security
+        self.pool_idle_timeout = pool_idle_timeout
+        self.settings = {
+            "host": host,
+            "port": port,
+            "username": username,
+            "security": security,
+            "pool_size": pool_size,
+            "pool_idle_timeout": pool_idle_timeout,
+        }
+        self.context = ssl.create_default_context() if security != "none" else None
+        self.slots = asyncio.Semaphore(pool_size)
+        # most recently used last, so light traffic keeps reusing the same session
+        self.idle: List[SMTPConnection] = []
+        self.connections_opened = 0
+
+    async def _acquire(self) -> SMTPConnection:
+        while self.idle:
+            connection = self.idle.pop()
+            if not connection.closed and time.monotonic() - connection.last_used < self.pool_idle_timeout:
+                return connection
+            await connection.quit()
+        try:
+            connection = await SMTPConnection.open(self.host, self.port, self.security, self.username, self.api_key, self.context)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise SMTPSendError(421, f"could not connect to {self.host}:{self.port}: {e}")
+        self.connections_opened += 1
+        return connection
+
+    async def send(self, payload: Mapping[str, Any]) -> TransportResponse:
+        messages = payload_messages(payload)
+        sent = 0
+        async with self.slots:
+            while True:
+                connection = await self._acquire()
+                try:
+                    for sender, recipients, message, _ in messages[sent:]:
+                        await connection.send(sender, recipients, message)
+                        sent += 1
+                except SMTPSendError as e:
+                    if e.smtp_code == 421:
+                        connection.abort()
+                    if not connection.closed:
+                        self.idle.append(connection)
+                    raise
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    connection.abort()
+                    if connection.used:
+                        # the server may have dropped a session that sat idle; carry on with another
+                        continue
+                    raise SMTPSendError(421, f"connection to {self.host}:{self.port} lost: {e}")
+                except BaseException:
+                    # cancelled mid-transaction, so the session is in an unknown state
+                    connection.abort()
+                    raise
+                self.idle.append(connection)
+                break
+        return TransportResponse(202, {"x-message-id": messages[0][3].strip("<>") if messages else ""})
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for connection in idle:
+            await connection.quit()
@@ -0,0 +1,243 @@
+"""
+Durable outbound message spool backed by SQLite, and the worker that drains it.
+"""
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from viam.logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 10
+MAX_RETRY_DELAY = 300.0
+IDLE_POLL_INTERVAL = 1.0
+
+
+class Spool():
+    """An append-only queue of rendered mail payloads that survives process restarts.
+
+    Entries are written in WAL mode with synchronous=FULL so an accepted message is on
+    disk before its id is returned. Delivery is at-least-once: an entry is claimed before
+    it is sent and only deleted once SendGrid has accepted it, and entries left claimed
+    by a crash are returned to the queue when the spool is reopened.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        import sqlite3
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                inflight INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_due ON messages (inflight, next_attempt)")
+        with self.lock:
+            recovered = self.db.execute("UPDATE messages SET inflight = 0 WHERE inflight = 1").rowcount
+        if recovered:
+            LOGGER.info(f"recovered {recovered} unacknowledged message(s) from {path}")
+
+    def put(self, payload: Mapping[str, Any], message_id: Optional[str] = None) -> str:
+        message_id = message_id or uuid.uuid4().hex
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO messages (id, payload, created) VALUES (?, ?, ?)",
+                (message_id, json.dumps(payload), time.time()),
+            )
+        return message_id
+
+    def claim(self, limit: int) -> List[Tuple[str, Dict[str, Any], int]]:
+        """Marks up to limit due entries as in flight and returns (id, payload, attempts) for each."""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.db.execute(
+                    "SELECT seq, id, payload, attempts FROM messages WHERE inflight = 0 AND next_attempt <= ? ORDER BY seq LIMIT ?",
+                    (time.time(), limit),
+                ).fetchall()
+                self.db.executemany("UPDATE messages SET inflight = 1 WHERE seq = ?", [(row[0],) for row in rows])
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return [(row[1], json.loads(row[2]), row[3]) for row in rows]
+
+    def ack(self, message_id: str):
+        with self.lock:
+            self.db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def retry(self, message_id: str, error: str, delay: float):
+        with self.lock:
+            self.db.execute(
+                "UPDATE messages SET inflight = 0, attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay, error, message_id),
+            )
+
+    def expedite(self):
+        """Makes every waiting entry due immediately."""
+        with self.lock:
+            self.db.execute("UPDATE messages SET next_attempt = 0 WHERE inflight = 0")
+
+    def next_due(self) -> Optional[float]:
+        with self.lock:
+            row = self.db.execute("SELECT MIN(next_attempt) FROM messages WHERE inflight = 0").fetchone()
+        return row[0]
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            pending, inflight, retrying, oldest = self.db.execute(
+                "SELECT COUNT(*) - COALESCE(SUM(inflight), 0), COALESCE(SUM(inflight), 0), COALESCE(SUM(attempts > 0), 0), MIN(created) FROM messages"
+            ).fetchone()
+            last_error = self.db.execute(
+                "SELECT last_error FROM messages WHERE last_error IS NOT NULL ORDER BY seq DESC LIMIT 1"
+            ).fetchone()
+        return {
+            "pending": pending,
+            "inflight": inflight,
+            "retrying": retrying,
+            "oldest_age": time.time() - oldest if oldest is not None else 0.0,
+            "last_error": last_error[0] if last_error else "",
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class QueueWorker():
+    """Drains a Spool in the background with bounded concurrency.
+
+    send is called with each payload; entries are acknowledged when it returns and
+    retried with exponential backoff when it raises, unless is_permanent says the
+    error will never succeed or max_attempts is reached. on_done, if given, is called
+    with the id and the response once an entry is delivered, or the error once it is
+    dropped.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        send: Callable[[Dict[str, Any]], Awaitable[Any]],
+        concurrency: int,
+        is_permanent: Callable[[Exception], bool] = lambda e: False,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        on_done: Optional[Callable[[str, Any, Optional[Exception]], None]] = None,
+    ):
+        self.spool = spool
+        self.send = send
+        self.concurrency = concurrency
+        self.is_permanent = is_permanent
+        self.max_attempts = max_attempts
+        self.on_done = on_done
+        self.wakeup = asyncio.Event()
+        # flush requests not yet seen by the worker, and those waiting on its current pass
+        self.flush_requests: List[asyncio.Future] = []
+        self.flushing: List[asyncio.Future] = []
+        self.delivered = 0
+        self.dropped = 0
+        self.inflight: set = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for task in list(self.inflight):
+            task.cancel()
+        if self.inflight:
+            await asyncio.gather(*self.inflight, return_exceptions=True)
+
+    def notify(self):
+        self.wakeup.set()
+
+    async def flush(self, timeout: Optional[float]) -> bool:
+        """Delivers everything queued now, ignoring retry backoff; returns whether the spool emptied."""
+        request = asyncio.get_running_loop().create_future()
+        self.flush_requests.append(request)
+        self.notify()
+        try:
+            await asyncio.wait_for(asyncio.shield(request), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return (await asyncio.to_thread(self.spool.status))["pending"] == 0
+
+    async def _run(self):
+        while True:
+            # cleared before looking for work so a notify() during this pass is not lost
+            self.wakeup.clear()
+            if self.flush_requests:
+                requests, self.flush_requests = self.flush_requests, []
+                await asyncio.to_thread(self.spool.expedite)
+                self.flushing.extend(requests)
+
+            free = self.concurrency - len(self.inflight)
+            entries = await asyncio.to_thread(self.spool.claim, free) if free > 0 else []
+            for message_id, payload, attempts in entries:
+                task = asyncio.create_task(self._deliver(message_id, payload, attempts))
+                self.inflight.add(task)
+                task.add_done_callback(self._done)
+
+            if not entries and not self.inflight:
+                for request in self.flushing:
+                    if not request.done():
+                        request.set_result(None)
+                self.flushing = []
+            if entries and len(self.inflight) < self.concurrency:
+                continue
+
+            next_due = await asyncio.to_thread(self.spool.next_due) if not self.inflight else None
+            wait = IDLE_POLL_INTERVAL if next_due is None else min(max(next_due - time.time(), 0), IDLE_POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _done(self, task: asyncio.Task):
+        self.inflight.discard(task)
+        self.notify()
+
+    async def _deliver(self, message_id: str, payload: Dict[str, Any], attempts: int):
+        try:
+            response = await self.send(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            if self.is_permanent(e) or attempts + 1 >= self.max_attempts:
+                LOGGER.error(f"Dropping queued email {message_id} after {attempts + 1} attempt(s): {error}")
+                await asyncio.to_thread(self.spool.ack, message_id)
+                self.dropped += 1
+                if self.on_done is not None:
+                    self.on_done(message_id, None, e)
+            else:
+                delay = min(2 ** attempts, MAX_RETRY_DELAY)
+                LOGGER.warning(f"Failed to send queued email {message_id}, retrying in {delay}s: {error}")
+                await asyncio.to_thread(self.spool.retry, message_id, error, delay)
+            return
+        await asyncio.to_thread(self.spool.ack, message_id)
+        self.delivered += 1
+        if self.on_done is not None:
+            self.on_done(message_id, response, None)
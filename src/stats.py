@@ -0,0 +1,198 @@
+"""
+Low-overhead runtime metrics: counters, gauges and fixed-size latency histograms.
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Dict, List, Mapping, Optional
+
+from viam.logging import getLogger
+
+LOGGER = getLogger(__name__)
+
+# histogram buckets grow by 2**(1/8) (about 9%) from 1 microsecond, so a quantile is
+# reported within 9% of the true value using a fixed 256 counters per histogram
+HISTOGRAM_MIN = 1e-6
+HISTOGRAM_STEPS_PER_DOUBLING = 8
+HISTOGRAM_BUCKETS = 256
+QUANTILES = (0.5, 0.95, 0.99)
+# the metrics endpoint has no authentication, so it is only reachable from the robot unless configured otherwise
+DEFAULT_STATS_HOST = "127.0.0.1"
+
+
+class Histogram():
+    """A log-bucketed latency histogram using constant memory."""
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        if seconds > HISTOGRAM_MIN:
+            index = int(math.log2(seconds / HISTOGRAM_MIN) * HISTOGRAM_STEPS_PER_DOUBLING)
+            if index >= HISTOGRAM_BUCKETS:
+                index = HISTOGRAM_BUCKETS - 1
+        else:
+            index = 0
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the q-th quantile."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(HISTOGRAM_MIN * 2 ** ((index + 1) / HISTOGRAM_STEPS_PER_DOUBLING), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        summary = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+        for q in QUANTILES:
+            summary[f"p{int(q * 100)}"] = self.quantile(q)
+        return summary
+
+
+class Stats():
+    """Counters, gauges and per-stage latency histograms for one resource.
+
+    Recording is a dict lookup and a few arithmetic operations on the event loop thread,
+    with no locking, so it stays well under a microsecond per event.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clears counters and histograms. Gauges track current state, so they are kept."""
+        self.started = time.time()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        if not hasattr(self, "gauges"):
+            self.gauges: Dict[str, int] = {"in_flight": 0, "waiting": 0}
+
+    def observe(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name: str, amount: int):
+        self.gauges[name] = self.gauges.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "uptime": time.time() - self.started,
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "latency": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+        }
+
+
+def prometheus_text(snapshot: Mapping[str, object], prefix: str = "sendgrid_email") -> str:
+    """Formats a Stats snapshot in the Prometheus text exposition format."""
+    lines = [f"# TYPE {prefix}_uptime_seconds gauge", f"{prefix}_uptime_seconds {snapshot['uptime']}"]
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    lines.append(f"# TYPE {prefix}_stage_seconds summary")
+    for stage, summary in sorted(snapshot["latency"].items()):
+        for q in QUANTILES:
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} {summary[f"p{int(q * 100)}"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {summary["mean"] * summary["count"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter():
+    """Publishes metrics in Prometheus text format to a file, an HTTP port on host, or both."""
+
+    def __init__(
+        self,
+        snapshot: Callable[[], Mapping[str, object]],
+        path: Optional[str] = None,
+        port: Optional[int] = None,
+        interval: float = 15.0,
+        host: str = DEFAULT_STATS_HOST,
+    ):
+        self.snapshot = snapshot
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.host = host
+        self.task: Optional[asyncio.Task] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def matches(self, path: Optional[str], port: Optional[int], interval: float, host: str) -> bool:
+        return (self.path, self.port, self.interval, self.host) == (path, port, interval, host)
+
+    async def start(self):
+        if self.path is not None:
+            self.task = asyncio.create_task(self._write_periodically())
+        if self.port is not None:
+            self.server = await asyncio.start_server(self._serve, self.host, self.port)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _write_periodically(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._write, prometheus_text(self.snapshot()))
+            except Exception as e:
+                LOGGER.warning(f"Failed to write metrics to {self.path}: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _write(self, text: str):
+        # write then rename, so a scraper never reads a partial file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = prometheus_text(self.snapshot()).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,42 @@
+"""
+Compiled <<placeholder>> templates for preset messages.
+"""
+
+import re
+from typing import Any, FrozenSet, List, Mapping, Tuple
+
+PLACEHOLDER = re.compile(r"<<([^<>]+)>>")
+
+
+class CompiledTemplate():
+    """A template pre-split into literal segments and placeholder slots.
+
+    Rendering fills the slots and joins the segments in a single pass, instead of
+    scanning the whole text once per template variable.
+    """
+
+    __slots__ = ("source", "parts", "slots", "variables")
+
+    def __init__(self, source: str):
+        self.source = source
+        # re.split with one group alternates literal text and placeholder names
+        self.parts: List[str] = PLACEHOLDER.split(source)
+        self.slots: Tuple[Tuple[int, str], ...] = tuple((i, self.parts[i]) for i in range(1, len(self.parts), 2))
+        for i, name in self.slots:
+            self.parts[i] = f"<<{name}>>"
+        self.variables: FrozenSet[str] = frozenset(name for _, name in self.slots)
+
+    def missing(self, values: Mapping[str, Any]) -> List[str]:
+        """Returns the placeholders in this template that have no value in values."""
+        return sorted(self.variables.difference(values))
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        """Fills every placeholder that has a value; others are left as <<name>>."""
+        if not self.slots:
+            return self.source
+        parts = self.parts.copy()
+        for i, name in self.slots:
+            if name in values:
+                value = values[name]
+                parts[i] = value if isinstance(value, str) else str(value)
+        return "".join(parts)
@@ -0,0 +1,178 @@
+"""
+Transports that deliver mail send payloads: the pooled SendGrid v3 HTTP API and an
+in-memory recording sink. The SMTP transport is in smtp.py.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Mapping, Optional
+
+# httpx is imported when the first transport is created, not when the module registers
+if TYPE_CHECKING:
+    import httpx
+
+SENDGRID_API_HOST = "https://api.sendgrid.com"
+MAIL_SEND_PATH = "/v3/mail/send"
+USER_AGENT = "viam-sendgrid-email"
+
+DEFAULT_MEMORY_CAPACITY = 1000
+
+# the SMTP transport's connection security modes and the port each uses by default;
+# defined here so configuration can be checked without importing smtp.py
+SMTP_PORTS = {"starttls": 587, "tls": 465, "none": 25}
+SMTP_SECURITY = tuple(SMTP_PORTS)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 60.0
+
+
+class SendError(Exception):
+    """Raised when a transport's server refuses a message.
+
+    status_code is in HTTP terms whatever the transport, so retries, key ejection and the
+    circuit breaker treat every transport alike.
+    """
+
+    def __init__(self, status_code: int, message: str, headers: Optional[Mapping[str, str]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+
+
+class SendGridError(SendError):
+    """Raised when SendGrid answers a send with a non-2xx status."""
+
+    def __init__(self, status_code: int, body: str, headers: Mapping[str, str]):
+        super().__init__(status_code, f"HTTP Error {status_code}: {body}", headers)
+        self.body = body
+
+
+class TransportResponse():
+    """The response to a send made by a transport other than the SendGrid API."""
+
+    __slots__ = ("status_code", "headers")
+
+    def __init__(self, status_code: int, headers: Mapping[str, str]):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class PreparedPayload(dict):
+    """A mail payload that carries its own JSON encoding, so it is not serialized again."""
+
+    __slots__ = ("body",)
+
+    def __init__(self, payload: Mapping[str, Any], body: bytes):
+        super().__init__(payload)
+        self.body = body
+
+
+def encode_payload(payload: Mapping[str, Any]) -> bytes:
+    if isinstance(payload, PreparedPayload):
+        return payload.body
+    return json.dumps(payload).encode("utf-8")
+
+
+class Transport(ABC):
+    """Delivers SendGrid v3 mail send payloads.
+
+    Rendering, presets and attachments all produce the same payload, so a transport only
+    has to deliver it. send returns a response with a status_code and headers, and raises
+    SendError when the message is refused. Each transport is built for one key and a dict
+    of settings, and is reused across reconfigures while both are unchanged.
+    """
+
+    name = ""
+    api_key: str = ""
+    settings: Dict[str, Any] = {}
+
+    def matches(self, name: str, api_key: str, settings: Mapping[str, Any]) -> bool:
+        """Returns whether this transport can be reused for the given settings."""
+        return (self.name, self.api_key, self.settings) == (name, api_key, settings)
+
+    @abstractmethod
+    async def send(self, payload: Mapping[str, Any]) -> Any:
+        """Delivers payload, returning the response or raising SendError."""
+
+    async def close(self):
+        pass
+
+
+class SendGridTransport(Transport):
+    """Sends mail payloads over a persistent, keep-alive connection pool.
+
+    One transport is shared by every send on a resource, so connections (and their
+    TLS sessions) are reused across do_command calls instead of being re-established
+    for every message.
+    """
+
+    name = "sendgrid"
+
+    def __init__(
+        self,
+        api_key: str,
+        host: str = SENDGRID_API_HOST,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+        http2: bool = False,
+        timeout: Optional[float] = None,
+    ):
+        self.api_key = api_key
+        self.host = host
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.http2 = http2
+        self.settings = {"host": host, "pool_size": pool_size, "pool_idle_timeout": pool_idle_timeout, "http2": http2}
+        import httpx
+        self.client = httpx.AsyncClient(
+            base_url=host,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "User-Agent": USER_AGENT,
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=pool_idle_timeout,
+            ),
+            http2=http2,
+            timeout=timeout,
+        )
+
+    async def send(self, payload: Mapping[str, Any]) -> "httpx.Response":
+        response = await self.client.post(MAIL_SEND_PATH, content=encode_payload(payload))
+        if response.status_code >= 400:
+            raise SendGridError(response.status_code, response.text, response.headers)
+        return response
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class MemoryTransport(Transport):
+    """Accepts every payload without any network, keeping the most recent ones.
+
+    For load tests and CI, where rendering, batching and the send path should run at full
+    speed. Payloads are kept as given, not copied.
+    """
+
+    name = "memory"
+
+    def __init__(self, api_key: str = "", capacity: int = DEFAULT_MEMORY_CAPACITY):
+        self.api_key = api_key
+        self.settings = {"capacity": capacity}
+        self.messages: Deque[Mapping[str, Any]] = deque(maxlen=capacity)
+        self.count = 0
+
+    async def send(self, payload: Mapping[str, Any]) -> TransportResponse:
+        self.messages.append(payload)
+        self.count += 1
+        return TransportResponse(202, {"x-message-id": f"memory-{self.count}"})
+
+    def recorded(self, limit: Optional[int] = None) -> List[Mapping[str, Any]]:
+        """Returns the kept payloads, oldest first, or only the newest limit of them."""
+        messages = list(self.messages)
+        return messages[-limit:] if limit else messages
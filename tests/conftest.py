@@ -1,7 +1,7 @@
 import pytest
 import sys
 from pathlib import Path
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 from viam.proto.app.robot import ComponentConfig
 from viam.utils import struct_to_dict
 
@@ -15,9 +15,10 @@ def mock_logger():
 
 @pytest.fixture
 def mock_sendgrid_client():
-    """Return a mock SendGridAPIClient for testing."""
+    """Return a mock SendGridTransport for testing."""
     client = MagicMock()
-    client.send = MagicMock()  # Synchronous send method
+    client.send = AsyncMock()  # Asynchronous send method
+    client.close = AsyncMock()
     return client
 
 @pytest.fixture
@@ -47,4 +48,22 @@ def mock_struct_to_dict():
             "preset_messages": {}
         }
     mock = MagicMock(side_effect=_struct_to_dict_side_effect)
-    return mock
\ No newline at end of file
+    return mock
+
+@pytest.fixture
+async def sendgrid_stub():
+    """Start a local SendGrid stand-in server for the duration of a test."""
+    from tests.sendgrid_stub import SendGridStub
+    stub = SendGridStub()
+    await stub.start()
+    yield stub
+    await stub.stop()
+
+@pytest.fixture
+async def smtp_stub():
+    """Start a local SMTP stand-in server for the duration of a test."""
+    from tests.smtp_stub import SMTPStub
+    stub = SMTPStub()
+    await stub.start()
+    yield stub
+    await stub.stop()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import random
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class SendGridStub():
+    """A local stand-in for the SendGrid /v3/mail/send endpoint.
+
+    Speaks plain HTTP/1.1 with keep-alive, records every request and counts the TCP
+    connections it accepts so tests can check connection reuse. Scripted responses are
+    returned first, in order; after that, error_rate and throttle_rate inject random 500
+    and 429 responses. With record=False, request bodies are counted but not kept.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        responses: Optional[List[Tuple[int, Dict[str, str]]]] = None,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: str = "1",
+        record: bool = True,
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.responses: Deque[Tuple[int, Dict[str, str]]] = deque(responses or [])
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.record = record
+        self.port = port
+        self.requests: List[Tuple[str, Dict[str, str], dict]] = []
+        self.request_count = 0
+        self.connections = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.url = ""
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _next_response(self) -> Tuple[int, Dict[str, str]]:
+        if self.responses:
+            return self.responses.popleft()
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429, {"Retry-After": self.retry_after}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return 202, {}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                request_line = lines[0]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                self.request_count += 1
+                if self.record:
+                    self.requests.append((request_line, headers, json.loads(body) if body else {}))
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, response_headers = self._next_response()
+                response_body = b"" if status < 400 else json.dumps({"errors": [{"message": "stub error"}]}).encode()
+                response = [f"HTTP/1.1 {status} Stub", f"Content-Length: {len(response_body)}"]
+                if status == 202:
+                    response.append(f"X-Message-Id: stub-{self.request_count}")
+                response.extend(f"{name}: {value}" for name, value in response_headers.items())
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1") + response_body)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        finally:
+            writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the SendGrid /v3/mail/send endpoint.")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", default="1", help="Retry-After header sent with 429 responses")
+    args = parser.parse_args()
+
+    stub = SendGridStub(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        record=False,
+        port=args.port,
+    )
+    print(await stub.start(), flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+import asyncio
+from typing import List, Optional, Set, Tuple
+
+from aiosmtpd.smtp import SMTP, AuthResult
+
+
+class SMTPStub():
+    """A local SMTP server, built on aiosmtpd, that records the messages it accepts.
+
+    Offers PIPELINING and AUTH PLAIN over plain TCP, accepting only password as the
+    password, and counts the connections and logins it accepts so tests can check that
+    sessions are reused. Recipients in reject are refused with a 550.
+    """
+
+    def __init__(self, password: str = "SG.test-key"):
+        self.password = password
+        self.reject: Set[str] = set()
+        self.messages: List[Tuple[str, List[str], bytes]] = []
+        self.connections = 0
+        self.logins = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    async def start(self) -> int:
+        self.server = await asyncio.get_running_loop().create_server(self._protocol, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _protocol(self) -> SMTP:
+        self.connections += 1
+        return SMTP(self, hostname="stub", auth_require_tls=False, authenticator=self._authenticate)
+
+    def _authenticate(self, server, session, envelope, mechanism, auth_data) -> AuthResult:
+        if auth_data.password.decode() != self.password:
+            return AuthResult(success=False, handled=False)
+        self.logins += 1
+        return AuthResult(success=True)
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        return responses[:-1] + ["250-PIPELINING", responses[-1]]
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return "550 5.1.1 no such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.mail_from, list(envelope.rcpt_tos), envelope.content))
+        return "250 OK"
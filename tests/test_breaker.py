@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+from src.breaker import CircuitBreaker
+
+SEND_COMMAND = {
+    "command": "send",
+    "to": ["test@example.com"],
+    "subject": "Test Subject",
+    "body": "<p>Test Body</p>"
+}
+
+def breaker_config(sendgrid_stub, **attributes):
+    return {
+        "api_host": sendgrid_stub.url,
+        "max_retries": 0,
+        "breaker_min_requests": 2,
+        "breaker_open_time": 0.2,
+        **attributes,
+    }
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_recovers(mock_component_config, sendgrid_stub):
+    """Test the circuit opens after repeated 503s, fails fast while open, and closes after a good probe."""
+    sendgrid_stub.responses.extend([(503, {}), (503, {}), (202, {})])
+    with patch("src.sendgridEmail.struct_to_dict", return_value=breaker_config(sendgrid_stub)):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for _ in range(2):
+            assert "error" in await email_service.do_command(SEND_COMMAND)
+        status = await email_service.do_command({"command": "breaker_status"})
+        assert status["state"] == "open"
+        assert status["opens"] == 1
+
+        result = await email_service.do_command(SEND_COMMAND)
+        assert result == {"error": "circuit breaker is open: SendGrid is failing"}
+        assert len(sendgrid_stub.requests) == 2
+
+        await asyncio.sleep(0.25)
+        assert (await email_service.do_command({"command": "breaker_status"}))["state"] == "half_open"
+        assert await email_service.do_command(SEND_COMMAND) == {"status_code": 202}
+        assert (await email_service.do_command({"command": "breaker_status"}))["state"] == "closed"
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_spilled_sends_replay_when_closed(mock_component_config, sendgrid_stub, tmp_path):
+    """Test sends refused by an open circuit are spilled to disk and delivered once it closes."""
+    sendgrid_stub.responses.extend([(503, {}), (503, {})])
+    config = breaker_config(sendgrid_stub, spill=True, spill_path=str(tmp_path / "spill.sqlite3"))
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for _ in range(2):
+            assert "error" in await email_service.do_command(SEND_COMMAND)
+
+        spilled = [await email_service.do_command(SEND_COMMAND) for _ in range(3)]
+        assert all(result["spilled"] for result in spilled)
+        status = await email_service.do_command({"command": "breaker_status"})
+        assert status["spill"]["pending"] + status["spill"]["inflight"] == 3
+
+        for _ in range(100):
+            status = await email_service.do_command({"command": "breaker_status"})
+            if status["spill"]["replayed"] == 3:
+                break
+            await asyncio.sleep(0.02)
+        assert status["state"] == "closed"
+        assert status["spill"]["pending"] == 0
+        messages = await email_service.do_command({"command": "status", "ids": [result["message_id"] for result in spilled]})
+        assert all(record["state"] == "sent" for record in messages["messages"].values())
+        await email_service.close()
+    assert len(sendgrid_stub.requests) == 5
+
+def test_slow_calls_count_as_failures():
+    """Test successful requests slower than breaker_slow_call open the circuit."""
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=4, slow_call=1.0)
+    breaker.record(True, 0.1)
+    breaker.record(True, 2.0)
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+    breaker.record(True, 3.0)
+    assert breaker.state == "open"
+    assert not breaker.allow()
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+from src.delivery import DeliveryLog
+
+SEND_COMMAND = {
+    "command": "send",
+    "to": ["test@example.com"],
+    "subject": "Test Subject",
+    "body": "<p>Test Body</p>",
+    "async": True
+}
+
+async def wait_for_state(email_service, message_id, state):
+    for _ in range(100):
+        result = await email_service.do_command({"command": "status", "id": message_id})
+        if result["messages"][message_id]["state"] == state:
+            return result["messages"][message_id]
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{message_id} never reached {state}: {result}")
+
+@pytest.mark.asyncio
+async def test_async_send_reports_status(mock_component_config, sendgrid_stub):
+    """Test an async send returns a message id at once and status follows it to sent."""
+    sendgrid_stub.latency = 0.1
+    sendgrid_stub.responses.extend([(202, {}), (400, {})])
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"api_host": sendgrid_stub.url}):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        sent = await email_service.do_command(SEND_COMMAND)
+        status = await email_service.do_command({"command": "status", "ids": [sent["message_id"], "missing"]})
+        assert status["messages"] == {sent["message_id"]: {"state": "pending"}, "missing": {"state": "unknown"}}
+        assert await wait_for_state(email_service, sent["message_id"], "sent") == \
+            {"state": "sent", "status_code": 202, "sendgrid_message_id": "stub-1"}
+
+        failed = await email_service.do_command(SEND_COMMAND)
+        record = await wait_for_state(email_service, failed["message_id"], "failed")
+        assert record["error"].startswith("HTTP Error 400")
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_queued_send_reports_status(mock_component_config, sendgrid_stub, tmp_path):
+    """Test the status of a queued send is updated once the queue worker delivers it."""
+    config = {"api_host": sendgrid_stub.url, "queue": True, "queue_path": str(tmp_path / "outbox.sqlite3")}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(SEND_COMMAND)
+        record = await wait_for_state(email_service, result["message_id"], "sent")
+        await email_service.close()
+    assert record["status_code"] == 202
+
+def test_delivery_log_bounds():
+    """Test the delivery log overwrites its oldest records when full and expires old ones."""
+    log = DeliveryLog(capacity=3, ttl=60)
+    for message_id in "abcd":
+        log.add(message_id)
+    assert log.get("a") is None
+    assert [log.get(message_id).message_id for message_id in "bcd"] == ["b", "c", "d"]
+
+    log.resize(2)
+    assert log.get("b") is None
+    assert len(log) == 2
+
+    log.get("c").created -= 120
+    assert log.get("c") is None
+    assert log.get("d") is not None
+    log.add("e")
+    assert len(log) == 2
@@ -0,0 +1,67 @@
+import pytest
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+
+SEND_COMMAND = {
+    "command": "send",
+    "to": ["test@example.com"],
+    "subject": "Test Subject",
+    "body": "<p>Test Body</p>"
+}
+
+def key_counts(stub):
+    counts = {}
+    for _, headers, _ in stub.requests:
+        counts[headers["authorization"]] = counts.get(headers["authorization"], 0) + 1
+    return counts
+
+@pytest.mark.asyncio
+async def test_keys_share_sends_by_weight(mock_component_config, sendgrid_stub):
+    """Test sends are spread across api_keys in proportion to their weights."""
+    mock_component_config.attributes.fields["api_key"].string_value = ""
+    config = {
+        "api_host": sendgrid_stub.url,
+        "api_keys": [{"key": "SG.key-a", "weight": 3}, {"key": "SG.key-b", "name": "backup"}],
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for _ in range(8):
+            assert await email_service.do_command(SEND_COMMAND) == {"status_code": 202}
+        status = await email_service.do_command({"command": "key_status"})
+        await email_service.close()
+
+    assert key_counts(sendgrid_stub) == {"Bearer SG.key-a": 6, "Bearer SG.key-b": 2}
+    assert [key["name"] for key in status["keys"]] == ["...ey-a", "backup"]
+    assert [key["sent"] for key in status["keys"]] == [6, 2]
+
+@pytest.mark.asyncio
+async def test_rejected_key_is_ejected(mock_component_config, sendgrid_stub):
+    """Test a key answering 401 is ejected and its send moves to another key."""
+    sendgrid_stub.responses.append((401, {}))
+    config = {"api_host": sendgrid_stub.url, "api_keys": [{"key": "SG.key-b"}]}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for _ in range(3):
+            assert await email_service.do_command(SEND_COMMAND) == {"status_code": 202}
+        status = await email_service.do_command({"command": "key_status"})
+        await email_service.close()
+
+    assert key_counts(sendgrid_stub) == {"Bearer SG.test-key": 1, "Bearer SG.key-b": 3}
+    rejected = status["keys"][0]
+    assert rejected["ejections"] == 1
+    assert rejected["last_error"] == 401
+    assert 0 < rejected["ejected_for"] <= 60
+
+@pytest.mark.asyncio
+async def test_single_key_429_retries_rather_than_failing_over(mock_component_config, sendgrid_stub):
+    """Test a lone key that is rate limited retries itself, not counted as moving to another key."""
+    sendgrid_stub.responses.append((429, {"Retry-After": "0"}))
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"api_host": sendgrid_stub.url}):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        assert await email_service.do_command(SEND_COMMAND) == {"status_code": 202}
+        counters = email_service.stats.snapshot()["counters"]
+        await email_service.close()
+
+    assert key_counts(sendgrid_stub) == {"Bearer SG.test-key": 2}
+    assert counters["retries"] == 1
+    assert "key_failovers" not in counters
@@ -0,0 +1,97 @@
+import base64
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from src.sendgridEmail import sendgridEmail
+from tests.test_delivery import wait_for_state
+
+ATTACHMENT = base64.b64encode(b"\0" * 3000).decode()
+
+def send_command(recipients, **command):
+    return {
+        "command": "send",
+        "to": [f"{i}@example.com" for i in range(recipients)],
+        "subject": "Test Subject",
+        "body": "<p>Test Body</p>",
+        **command
+    }
+
+@pytest.mark.asyncio
+async def test_send_splits_recipients(mock_component_config, mock_sendgrid_client):
+    """Test a send to more recipients than a request allows is split, sharing one encoding of the attachment."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    command = send_command(2500, attachments=[{"content": ATTACHMENT, "filename": "log.bin"}])
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(command)
+
+    assert result["status_code"] == 202
+    assert result["requests"] == 3
+    assert [len(entry["to"]) for entry in result["results"]] == [1000, 1000, 500]
+    payloads = [call.args[0] for call in mock_sendgrid_client.send.call_args_list]
+    assert [to["email"] for payload in payloads for to in payload["personalizations"][0]["to"]] == command["to"]
+    for payload in payloads:
+        assert json.loads(payload.body) == payload
+        assert payload["attachments"][0]["content"] is payloads[0]["attachments"][0]["content"]
+
+@pytest.mark.asyncio
+async def test_send_batch_splits_by_size(mock_component_config, sendgrid_stub):
+    """Test a batch over the request size limit is split into the fewest requests that fit, each under it."""
+    command = {
+        "command": "send_batch",
+        "subject": "Test Subject",
+        "body": "<p>Test Body</p>",
+        "recipients": [{"to": f"{i}@example.com"} for i in range(10)],
+        "attachments": [{"content": ATTACHMENT, "filename": "log.bin"}]
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"api_host": sendgrid_stub.url}), \
+         patch("src.sendgridEmail.MAX_MESSAGE_SIZE", 4500):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(command)
+        await email_service.close()
+
+    assert [entry["status_code"] for entry in result["results"]] == [202] * 10
+    bodies = [json.dumps(body) for _, _, body in sendgrid_stub.requests]
+    # the attachment leaves room for three recipients in each request
+    assert [len(body["personalizations"]) for _, _, body in sendgrid_stub.requests] == [3, 3, 3, 1]
+    assert all(len(body) <= 4500 for body in bodies)
+    assert sorted(to["email"] for _, _, body in sendgrid_stub.requests for p in body["personalizations"] for to in p["to"]) == \
+        sorted(f"{i}@example.com" for i in range(10))
+
+@pytest.mark.asyncio
+async def test_split_send_reports_failed_requests(mock_component_config, mock_sendgrid_client):
+    """Test a split send reports which request failed, and one that cannot fit is refused before any upload."""
+    async def send_side_effect(payload):
+        if payload["personalizations"][0]["to"][0]["email"] == "2@example.com":
+            raise Exception("API Error")
+        return MagicMock(status_code=202)
+    mock_sendgrid_client.send.side_effect = send_side_effect
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client), \
+         patch("src.sendgridEmail.MAX_RECIPIENTS", 2):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(send_command(5))
+        assert result["error"] == "1 of 3 requests failed: API Error"
+        assert result["results"][1] == {"to": ["2@example.com", "3@example.com"], "error": "API Error"}
+        assert "status_code" not in result
+
+        mock_sendgrid_client.send.reset_mock()
+        with patch("src.sendgridEmail.MAX_MESSAGE_SIZE", 1024):
+            result = await email_service.do_command(send_command(1, body="x" * 2000))
+        assert "over SendGrid's 1024 byte request limit" in result["error"]
+        mock_sendgrid_client.send.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_async_split_send_status(mock_component_config, sendgrid_stub):
+    """Test a split async send is reported sent only once all of its requests are."""
+    sendgrid_stub.latency = 0.05
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"api_host": sendgrid_stub.url}), \
+         patch("src.sendgridEmail.MAX_RECIPIENTS", 2):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        sent = await email_service.do_command(send_command(5, **{"async": True}))
+        record = await wait_for_state(email_service, sent["message_id"], "sent")
+        await email_service.close()
+
+    assert record["requests"] == 3
+    assert record["status_code"] == 202
+    assert len(sendgrid_stub.requests) == 3
@@ -0,0 +1,73 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+from src.ratelimit import server_delay
+
+SEND_COMMAND = {
+    "command": "send",
+    "to": ["test@example.com"],
+    "subject": "Test Subject",
+    "body": "<p>Test Body</p>"
+}
+
+@pytest.mark.asyncio
+async def test_retries_rate_limited_and_unavailable(mock_component_config, sendgrid_stub):
+    """Test a send is retried after scripted 429 and 503 responses, honoring Retry-After."""
+    sendgrid_stub.responses.extend([(429, {"Retry-After": "0.2"}), (503, {})])
+    config = {"api_host": sendgrid_stub.url, "retry_base_delay": 0.01}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        start = time.monotonic()
+        result = await email_service.do_command(SEND_COMMAND)
+        elapsed = time.monotonic() - start
+        await email_service.close()
+
+    assert result == {"status_code": 202}
+    assert len(sendgrid_stub.requests) == 3
+    assert elapsed >= 0.2
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries(mock_component_config, sendgrid_stub):
+    """Test a send returns the last error once max_retries is exhausted."""
+    sendgrid_stub.responses.extend([(503, {})] * 3)
+    config = {"api_host": sendgrid_stub.url, "retry_base_delay": 0.01, "max_retries": 2}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(SEND_COMMAND)
+        await email_service.close()
+
+    assert result["error"].startswith("HTTP Error 503")
+    assert len(sendgrid_stub.requests) == 3
+
+@pytest.mark.asyncio
+async def test_rate_limit_does_not_block_loop(mock_component_config, sendgrid_stub):
+    """Test the token bucket spaces out sends while the event loop keeps running."""
+    config = {"api_host": sendgrid_stub.url, "rate_limit": 20, "rate_limit_burst": 1}
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        ticker_task = asyncio.create_task(ticker())
+        start = time.monotonic()
+        results = await asyncio.gather(*[email_service.do_command(SEND_COMMAND) for _ in range(5)])
+        elapsed = time.monotonic() - start
+        ticker_task.cancel()
+        await email_service.close()
+
+    assert results == [{"status_code": 202}] * 5
+    assert elapsed >= 0.19
+    assert ticks >= 10
+
+def test_server_delay_headers():
+    """Test Retry-After takes precedence over X-RateLimit-Reset."""
+    assert server_delay({"retry-after": "3"}) == 3.0
+    assert 9 < server_delay({"x-ratelimit-reset": str(time.time() + 10)}) <= 10
+    assert server_delay({}) is None
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+from src.schedule import parse_send_at
+from src.spool import Spool
+
+def send_command(send_at):
+    return {
+        "command": "send",
+        "to": ["test@example.com"],
+        "subject": "Shift summary",
+        "body": "<p>Shift summary</p>",
+        "send_at": send_at
+    }
+
+@pytest.mark.asyncio
+async def test_scheduled_send(mock_component_config, sendgrid_stub, tmp_path):
+    """Test a scheduled send is listed until its send time and then delivered."""
+    config = {"api_host": sendgrid_stub.url, "schedule_path": str(tmp_path / "schedule.sqlite3")}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        later = await email_service.do_command(send_command(time.time() + 3600))
+        soon = await email_service.do_command(send_command(time.time() + 0.1))
+
+        listed = await email_service.do_command({"command": "schedule_list"})
+        assert [entry["id"] for entry in listed["scheduled"]] == [soon["message_id"], later["message_id"]]
+        assert listed["scheduled"][0]["subject"] == "Shift summary"
+        assert len(sendgrid_stub.requests) == 0
+
+        await asyncio.sleep(0.3)
+        assert len(sendgrid_stub.requests) == 1
+        status = await email_service.do_command({"command": "status", "ids": [soon["message_id"], later["message_id"]]})
+        assert status["messages"][soon["message_id"]]["state"] == "sent"
+        assert status["messages"][later["message_id"]]["state"] == "pending"
+        listed = await email_service.do_command({"command": "schedule_list"})
+        assert listed["total"] == 1
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_schedule_cancel(mock_component_config, sendgrid_stub, tmp_path):
+    """Test a cancelled scheduled send is never delivered."""
+    config = {"api_host": sendgrid_stub.url, "schedule_path": str(tmp_path / "schedule.sqlite3")}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(send_command(time.time() + 0.1))
+        assert await email_service.do_command({"command": "schedule_cancel", "id": result["message_id"]}) == {"cancelled": True}
+        assert await email_service.do_command({"command": "schedule_cancel", "id": result["message_id"]}) == {"cancelled": False}
+
+        await asyncio.sleep(0.2)
+        status = await email_service.do_command({"command": "status", "id": result["message_id"]})
+        await email_service.close()
+    assert len(sendgrid_stub.requests) == 0
+    assert status["messages"][result["message_id"]] == {"state": "failed", "error": "cancelled"}
+
+@pytest.mark.asyncio
+async def test_schedule_survives_restart(mock_component_config, sendgrid_stub, tmp_path):
+    """Test scheduled sends are reloaded from disk, and ones that came due while stopped are sent."""
+    config = {"api_host": sendgrid_stub.url, "schedule_path": str(tmp_path / "schedule.sqlite3")}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        await email_service.do_command(send_command(time.time() + 0.1))
+        later = await email_service.do_command(send_command("2999-01-01T00:00:00"))
+        await email_service.close()
+        await asyncio.sleep(0.2)
+
+        email_service = sendgridEmail.new(mock_component_config, {})
+        await asyncio.sleep(0.1)
+        listed = await email_service.do_command({"command": "schedule_list"})
+        await email_service.close()
+    assert len(sendgrid_stub.requests) == 1
+    assert [entry["id"] for entry in listed["scheduled"]] == [later["message_id"]]
+
+def test_parse_send_at():
+    """Test send_at is accepted as epoch seconds or ISO 8601, with UTC assumed."""
+    assert parse_send_at(1700000000) == 1700000000.0
+    assert parse_send_at("2023-11-14T22:13:20Z") == 1700000000.0
+    assert parse_send_at("2023-11-14T22:13:20.5z") == 1700000000.5
+    assert parse_send_at("2023-11-14T22:13:20") == 1700000000.0
+    assert parse_send_at("2023-11-14T23:13:20+01:00") == 1700000000.0
+    with pytest.raises(ValueError):
+        parse_send_at("tomorrow")
+    for value in (float("nan"), float("inf"), float("-inf")):
+        with pytest.raises(ValueError):
+            parse_send_at(value)
+
+@pytest.mark.asyncio
+async def test_commands_after_close(mock_component_config, tmp_path):
+    """Test commands still answer once the service is closed, refusing scheduled sends."""
+    config = {"transport": "memory", "schedule_path": str(tmp_path / "schedule.sqlite3")}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        await email_service.close()
+        result = await email_service.do_command(send_command(time.time() + 60))
+        assert result == {"error": "scheduled sends are not accepted after the service is closed"}
+        assert (await email_service.do_command({"command": "recorded_messages"}))["count"] == 0
+
+def test_first_command_starts_background_work(mock_component_config, tmp_path):
+    """Test messages spooled or scheduled by a previous run are sent after a reconfigure made without an event loop."""
+    config = {
+        "transport": "memory",
+        "queue": True,
+        "queue_path": str(tmp_path / "outbox.sqlite3"),
+        "schedule_path": str(tmp_path / "schedule.sqlite3"),
+    }
+
+    async def previous_run():
+        email_service = sendgridEmail.new(mock_component_config, {})
+        await email_service.do_command(send_command(time.time() + 0.1))
+        await email_service.close()
+        spool = Spool(config["queue_path"])
+        spool.put({"from": {"email": "from@example.com"}, "subject": "Queued", "personalizations": [{"to": [{"email": "test@example.com"}]}]})
+        spool.close()
+
+    async def next_run(email_service):
+        await asyncio.sleep(0.2)
+        assert (await email_service.do_command({"command": "recorded_messages"}))["count"] == 0
+        for _ in range(50):
+            recorded = await email_service.do_command({"command": "recorded_messages"})
+            if recorded["count"] == 2:
+                break
+            await asyncio.sleep(0.01)
+        await email_service.close()
+        return recorded
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value=config):
+        asyncio.run(previous_run())
+        email_service = sendgridEmail.new(mock_component_config, {})
+        recorded = asyncio.run(next_run(email_service))
+    assert sorted(message["subject"] for message in recorded["messages"]) == ["Queued", "Shift summary"]
@@ -3,20 +3,24 @@ from unittest.mock import patch, MagicMock
 from viam.proto.app.robot import ComponentConfig
 from viam.services.generic import Generic
 from src.sendgridEmail import sendgridEmail, Preset
-from sendgrid import SendGridAPIClient
+from src.transport import SendGridTransport, SendGridError
+from src.attachments import encoded_size
 from sendgrid.helpers.mail import Mail
 import base64
+import asyncio
+import socket
+import time
 
 @pytest.mark.asyncio
 async def test_initialization(mock_component_config, mock_logger, mock_sendgrid_client):
     """Test sendgridEmail initialization and reconfiguration."""
-    with patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
         email_service = sendgridEmail.new(mock_component_config, {})
         assert isinstance(email_service, Generic)
-        assert email_service.from_email == "from@example.com"
-        assert email_service.from_email_name == "Test Sender"
-        assert email_service.enforce_preset is False
-        assert email_service.email_client == mock_sendgrid_client
+        assert email_service.send_config.from_email == "from@example.com"
+        assert email_service.send_config.from_email_name == "Test Sender"
+        assert email_service.send_config.enforce_preset is False
+        assert email_service.key_pool.keys[0].transport == mock_sendgrid_client
 
 @pytest.mark.asyncio
 async def test_validate_missing_api_key(mock_component_config):
@@ -40,7 +44,7 @@ async def test_send_basic_email(mock_component_config, mock_sendgrid_client):
     mock_response.status_code = 202
     mock_sendgrid_client.send.return_value = mock_response
 
-    with patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
         email_service = sendgridEmail.new(mock_component_config, {})
         command = {
             "command": "send",
@@ -73,7 +77,7 @@ async def test_send_with_attachment(mock_component_config, mock_sendgrid_client)
         return mock_response
     mock_sendgrid_client.send.side_effect = send_side_effect
 
-    with patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
         email_service = sendgridEmail.new(mock_component_config, {})
         command = {
             "command": "send",
@@ -138,7 +142,7 @@ async def test_send_with_common_mime_types(mock_component_config, mock_sendgrid_
         return mock_response
     mock_sendgrid_client.send.side_effect = send_side_effect
 
-    with patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
         email_service = sendgridEmail.new(mock_component_config, {})
         command = {
             "command": "send",
@@ -203,7 +207,7 @@ async def test_send_with_preset(mock_component_config, mock_sendgrid_client):
         }
     }
     with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
-         patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
 
         email_service = sendgridEmail.new(mock_component_config, {})
         command = {
@@ -217,8 +221,7 @@ async def test_send_with_preset(mock_component_config, mock_sendgrid_client):
         assert result == {"status_code": 202}
 
         # Grab and inspect the Mail payload
-        mail_obj: Mail = mock_sendgrid_client.send.call_args[0][0]
-        payload = mail_obj.get()
+        payload = mock_sendgrid_client.send.call_args[0][0]
 
         # Verify the subject was templated
         assert payload.get("subject") == "Alert: Test Issue"
@@ -232,7 +235,7 @@ async def test_send_with_preset(mock_component_config, mock_sendgrid_client):
 @pytest.mark.asyncio
 async def test_send_missing_to(mock_component_config, mock_sendgrid_client):
     """Test error when 'to' field is missing."""
-    with patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
         email_service = sendgridEmail.new(mock_component_config, {})
         command = {
             "command": "send",
@@ -247,7 +250,7 @@ async def test_send_api_failure(mock_component_config, mock_sendgrid_client):
     """Test handling of SendGrid API failure."""
     mock_sendgrid_client.send.side_effect = Exception("API Error")
 
-    with patch("src.sendgridEmail.SendGridAPIClient", return_value=mock_sendgrid_client):
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
         email_service = sendgridEmail.new(mock_component_config, {})
         command = {
             "command": "send",
@@ -256,4 +259,572 @@ async def test_send_api_failure(mock_component_config, mock_sendgrid_client):
             "body": "<p>Test SendGrid API Failure</p>"
         }
         result = await email_service.do_command(command)
-        assert result == {"error": "API Error"}
\ No newline at end of file
+        assert result == {"error": "API Error"}
+
+@pytest.mark.asyncio
+async def test_send_does_not_block_event_loop(mock_component_config, mock_sendgrid_client):
+    """Test concurrent sends overlap instead of queueing behind one another."""
+    async def slow_send(payload):
+        await asyncio.sleep(0.2)
+        return MagicMock(status_code=202)
+    mock_sendgrid_client.send.side_effect = slow_send
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Test Subject",
+            "body": "<p>Test Body</p>"
+        }
+        start = time.monotonic()
+        results = await asyncio.gather(*[email_service.do_command(command) for _ in range(5)])
+        elapsed = time.monotonic() - start
+        await email_service.close()
+
+        assert results == [{"status_code": 202}] * 5
+        assert mock_sendgrid_client.send.call_count == 5
+        assert elapsed < 0.6
+
+@pytest.mark.asyncio
+async def test_send_timeout(mock_component_config, mock_sendgrid_client):
+    """Test a send that exceeds send_timeout returns an error."""
+    async def slow_send(payload):
+        await asyncio.sleep(0.3)
+        return MagicMock(status_code=202)
+    mock_sendgrid_client.send.side_effect = slow_send
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"send_timeout": 0.05}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Test Subject",
+            "body": "<p>Test Body</p>"
+        }
+        result = await email_service.do_command(command)
+        await email_service.close()
+        assert result == {"error": "send timed out"}
+
+@pytest.mark.asyncio
+async def test_send_batch_personalizations(mock_component_config, mock_sendgrid_client):
+    """Test send_batch packs recipients into personalizations with per-recipient substitutions."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+
+    preset_config = {
+        "preset_messages": {
+            "alert": {
+                "subject": "Alert for <<name>>",
+                "body": "Hi <<name>>, <<issue>> on <<robot>>"
+            }
+        }
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send_batch",
+            "preset": "alert",
+            "template_vars": {"robot": "rover-1"},
+            "recipients": [
+                {"to": "a@example.com", "template_vars": {"name": "A", "issue": "low battery"}},
+                {"to": ["b@example.com", "c@example.com"], "template_vars": {"name": "B", "issue": "stuck"}}
+            ]
+        }
+        result = await email_service.do_command(command)
+
+        assert result == {"results": [
+            {"to": ["a@example.com"], "status_code": 202},
+            {"to": ["b@example.com", "c@example.com"], "status_code": 202}
+        ]}
+        mock_sendgrid_client.send.assert_called_once()
+        payload = mock_sendgrid_client.send.call_args[0][0]
+        assert payload["content"][0]["value"] == "Hi <<name>>, <<issue>> on rover-1"
+        personalizations = payload["personalizations"]
+        assert len(personalizations) == 2
+        assert personalizations[0]["subject"] == "Alert for A"
+        assert personalizations[0]["substitutions"] == {"<<name>>": "A", "<<issue>>": "low battery"}
+        assert personalizations[1]["to"] == [{"email": "b@example.com"}, {"email": "c@example.com"}]
+
+@pytest.mark.asyncio
+async def test_send_batch_overrides_shared_vars(mock_component_config, mock_sendgrid_client):
+    """Test a recipient's override of a shared variable reaches the body, and other recipients get the shared value."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send_batch",
+            "subject": "Alert for <<name>>",
+            "body": "Hi <<name>>, check <<robot>>",
+            "template_vars": {"name": "team", "robot": "rover-1"},
+            "recipients": [
+                {"to": "a@example.com", "template_vars": {"name": "A"}},
+                {"to": "b@example.com"}
+            ]
+        }
+        await email_service.do_command(command)
+
+        payload = mock_sendgrid_client.send.call_args[0][0]
+        assert payload["content"][0]["value"] == "Hi <<name>>, check rover-1"
+        personalizations = payload["personalizations"]
+        assert personalizations[0]["subject"] == "Alert for A"
+        assert personalizations[0]["substitutions"] == {"<<name>>": "A"}
+        assert personalizations[1]["subject"] == "Alert for team"
+        assert personalizations[1]["substitutions"] == {"<<name>>": "team"}
+
+@pytest.mark.asyncio
+async def test_send_batch_splits_requests(mock_component_config, mock_sendgrid_client):
+    """Test send_batch splits recipients across concurrent requests and reports per-recipient results."""
+    async def send_side_effect(payload):
+        if payload["personalizations"][0]["to"][0]["email"] == "2@example.com":
+            raise Exception("API Error")
+        return MagicMock(status_code=202)
+    mock_sendgrid_client.send.side_effect = send_side_effect
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client), \
+         patch("src.sendgridEmail.MAX_PERSONALIZATIONS", 2):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send_batch",
+            "subject": "Test Subject",
+            "body": "<p>Test Body</p>",
+            "recipients": [{"to": f"{i}@example.com"} for i in range(5)]
+        }
+        result = await email_service.do_command(command)
+
+        assert mock_sendgrid_client.send.call_count == 3
+        assert [r.get("status_code") for r in result["results"]] == [202, 202, None, None, 202]
+        assert result["results"][2] == {"to": ["2@example.com"], "error": "API Error"}
+
+@pytest.mark.asyncio
+async def test_send_preset_missing_template_vars(mock_component_config, mock_sendgrid_client):
+    """Test a preset send missing a template variable is rejected instead of sending a raw placeholder."""
+    preset_config = {
+        "preset_messages": {
+            "alert": {
+                "subject": "Alert: <<issue>>",
+                "body": "Issue detected on <<robot>>: <<issue>>"
+            }
+        }
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "preset": "alert",
+            "template_vars": {"issue": "Test Issue"}
+        }
+        result = await email_service.do_command(command)
+        assert result == {"error": "missing template_vars ['robot'] for preset 'alert'"}
+        mock_sendgrid_client.send.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_validate_preset_declared_template_vars(mock_component_config):
+    """Test validation reports presets whose declared template_vars do not match their placeholders."""
+    preset_config = {
+        "preset_messages": {
+            "alert": {
+                "subject": "Alert: <<issue>>",
+                "body": "Issue detected on <<robot>>",
+                "template_vars": ["issue", "severity"]
+            }
+        }
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config):
+        with pytest.raises(Exception, match=r"uses undeclared template_vars \['robot'\].*\['severity'\]"):
+            sendgridEmail.validate(mock_component_config)
+
+@pytest.mark.asyncio
+async def test_queued_send(mock_component_config, mock_sendgrid_client, tmp_path):
+    """Test queued sends return a message id immediately and are delivered by the background worker."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    queue_config = {"queue": True, "queue_path": str(tmp_path / "outbox.sqlite3")}
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value=queue_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Test Subject",
+            "body": "<p>Test Body</p>"
+        }
+        result = await email_service.do_command(command)
+        assert "message_id" in result
+
+        result = await email_service.do_command({"command": "queue_flush", "timeout": 5})
+        assert result["flushed"] is True
+        assert result["pending"] == 0
+        assert result["delivered"] == 1
+        mock_sendgrid_client.send.assert_called_once()
+        assert mock_sendgrid_client.send.call_args[0][0]["subject"] == "Test Subject"
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_queue_recovers_unacknowledged(mock_component_config, mock_sendgrid_client, tmp_path):
+    """Test messages claimed but never acknowledged before a restart are delivered on startup."""
+    from src.spool import Spool
+    queue_path = str(tmp_path / "outbox.sqlite3")
+    spool = Spool(queue_path)
+    spool.put({"subject": "Recovered"})
+    assert len(spool.claim(10)) == 1
+    spool.close()
+
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"queue": True, "queue_path": queue_path}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command({"command": "queue_flush", "timeout": 5})
+        assert result["flushed"] is True
+        assert mock_sendgrid_client.send.call_args[0][0] == {"subject": "Recovered"}
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_send_coalesces_repeats(mock_component_config, mock_sendgrid_client):
+    """Test repeats of a coalesced preset within its window are suppressed and summarized in a digest."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    preset_config = {
+        "preset_messages": {
+            "alert": {
+                "subject": "Alert: <<about>>",
+                "body": "<p><<about>> reading <<value>></p>",
+                "coalesce_window": 0.2,
+                "coalesce_vars": ["about"]
+            }
+        }
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for i in range(5):
+            result = await email_service.do_command({
+                "command": "send",
+                "to": ["test@example.com"],
+                "preset": "alert",
+                "template_vars": {"about": "lidar", "value": str(i)}
+            })
+            if i == 0:
+                assert result == {"status_code": 202}
+            else:
+                assert result == {"coalesced": True, "suppressed": i}
+        result = await email_service.do_command({
+            "command": "send",
+            "to": ["test@example.com"],
+            "preset": "alert",
+            "template_vars": {"about": "imu", "value": "0"}
+        })
+        assert result == {"status_code": 202}
+        assert mock_sendgrid_client.send.call_count == 2
+
+        await asyncio.sleep(0.3)
+        assert mock_sendgrid_client.send.call_count == 3
+        digest = mock_sendgrid_client.send.call_args[0][0]
+        assert digest["subject"] == "Alert: lidar (repeated 4 more times)"
+        assert "lidar reading 4" in digest["content"][0]["value"]
+        assert await email_service.do_command({"command": "coalesce_status"}) == {"open_windows": 0, "suppressed": 4, "digests_sent": 1}
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_send_coalesce_window_closes_on_failure(mock_component_config, mock_sendgrid_client):
+    """Test a coalesced preset whose first send fails does not suppress the next repeat or send a digest."""
+    mock_sendgrid_client.send.side_effect = [SendGridError(400, "bad request", {}), MagicMock(status_code=202)]
+    preset_config = {
+        "preset_messages": {
+            "alert": {"subject": "Alert: <<about>>", "body": "<p><<about>></p>", "coalesce_window": 0.2}
+        }
+    }
+    command = {"command": "send", "to": ["test@example.com"], "preset": "alert", "template_vars": {"about": "lidar"}}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        assert "error" in await email_service.do_command(command)
+        assert await email_service.do_command(command) == {"status_code": 202}
+        await asyncio.sleep(0.3)
+        assert mock_sendgrid_client.send.call_count == 2
+        assert await email_service.do_command({"command": "coalesce_status"}) == {"open_windows": 0, "suppressed": 0, "digests_sent": 0}
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_send_coalesce_repeats_of_failed_send(mock_component_config, mock_sendgrid_client):
+    """Test repeats held while the first send is in flight get its error if it fails, instead of being dropped."""
+    async def slow_send(payload):
+        await asyncio.sleep(0.05)
+        if mock_sendgrid_client.send.call_count == 1:
+            raise SendGridError(503, "unavailable", {})
+        return MagicMock(status_code=202)
+    mock_sendgrid_client.send.side_effect = slow_send
+    preset_config = {
+        "max_retries": 0,
+        "preset_messages": {
+            "alert": {"subject": "Alert: <<about>>", "body": "<p><<about>></p>", "coalesce_window": 0.2}
+        }
+    }
+    command = {"command": "send", "to": ["test@example.com"], "preset": "alert", "template_vars": {"about": "lidar"}}
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        results = await asyncio.gather(*[email_service.do_command(command) for _ in range(4)])
+        assert all(result["error"].startswith("HTTP Error 503") for result in results)
+        assert await email_service.do_command({"command": "coalesce_status"}) == {"open_windows": 0, "suppressed": 0, "digests_sent": 0}
+
+        results = await asyncio.gather(*[email_service.do_command(command) for _ in range(3)])
+        assert results == [{"status_code": 202}, {"coalesced": True, "suppressed": 1}, {"coalesced": True, "suppressed": 2}]
+        await asyncio.sleep(0.3)
+        assert mock_sendgrid_client.send.call_count == 3
+        assert mock_sendgrid_client.send.call_args[0][0]["subject"] == "Alert: lidar (repeated 2 more times)"
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_send_with_path_attachment(mock_component_config, mock_sendgrid_client, tmp_path):
+    """Test attachments given by path are encoded from the file and cached by content."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    snapshot = tmp_path / "snapshot.png"
+    snapshot.write_bytes(b"\x89PNG" + bytes(range(256)) * 10)
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(snapshot.read_bytes())
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"attachment_dirs": [str(tmp_path)]}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for path in [snapshot, snapshot, copy]:
+            command = {
+                "command": "send",
+                "to": ["test@example.com"],
+                "subject": "Snapshot",
+                "body": "<p>See attached.</p>",
+                "attachments": [{"path": str(path)}]
+            }
+            assert await email_service.do_command(command) == {"status_code": 202}
+
+        attachment = mock_sendgrid_client.send.call_args[0][0]["attachments"][0]
+        assert attachment["content"] == base64.b64encode(snapshot.read_bytes()).decode()
+        assert attachment["filename"] == "copy.png"
+        assert attachment["type"] == "image/png"
+        stats = await email_service.do_command({"command": "attachment_cache_status"})
+        assert stats["entries"] == 1
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+
+@pytest.mark.asyncio
+async def test_send_path_attachment_requires_attachment_dirs(mock_component_config, mock_sendgrid_client, tmp_path):
+    """Test attachments given by path are refused unless attachment_dirs is set and contains them."""
+    allowed = tmp_path / "allowed"
+    allowed.mkdir()
+    secret = tmp_path / "secret.json"
+    secret.write_text("{}")
+    command = {
+        "command": "send",
+        "to": ["test@example.com"],
+        "subject": "Report",
+        "body": "<p>See attached.</p>",
+        "attachments": [{"path": str(secret)}]
+    }
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(command)
+        assert result["error"] == "attachments given by path are not allowed unless attachment_dirs is configured"
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"attachment_dirs": [str(allowed)]}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(command)
+        assert "is not in an allowed attachment_dirs directory" in result["error"]
+    mock_sendgrid_client.send.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_send_path_attachment_reads_checked_path(mock_component_config, mock_sendgrid_client, tmp_path):
+    """Test a symlinked attachment is read from the file that was checked, even if the link is re-pointed after the check."""
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    allowed = tmp_path / "allowed"
+    allowed.mkdir()
+    snapshot = allowed / "snapshot-001.png"
+    snapshot.write_bytes(b"\x89PNG")
+    secret = tmp_path / "secret.json"
+    secret.write_text("{}")
+    latest = allowed / "latest.png"
+    latest.symlink_to(snapshot)
+
+    def repoint(size):
+        latest.unlink()
+        latest.symlink_to(secret)
+        return encoded_size(size)
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"attachment_dirs": [str(allowed)]}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client), \
+         patch("src.sendgridEmail.encoded_size", side_effect=repoint):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Snapshot",
+            "body": "<p>See attached.</p>",
+            "attachments": [{"path": str(latest)}]
+        }
+        assert await email_service.do_command(command) == {"status_code": 202}
+
+    attachment = mock_sendgrid_client.send.call_args[0][0]["attachments"][0]
+    assert attachment["content"] == base64.b64encode(b"\x89PNG").decode()
+    assert attachment["filename"] == "snapshot-001.png"
+
+@pytest.mark.asyncio
+async def test_send_oversized_attachment(mock_component_config, mock_sendgrid_client, tmp_path):
+    """Test attachments over SendGrid's size limit are rejected before they are encoded."""
+    report = tmp_path / "report.bin"
+    report.write_bytes(b"\0" * 1000)
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"attachment_dirs": [str(tmp_path)]}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client), \
+         patch("src.sendgridEmail.MAX_MESSAGE_SIZE", 1024), \
+         patch("src.attachments.AttachmentCache._encode") as mock_encode:
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Report",
+            "body": "<p>See attached.</p>",
+            "attachments": [{"path": str(report)}]
+        }
+        result = await email_service.do_command(command)
+        assert "over SendGrid's 1024 byte message limit" in result["error"]
+        mock_encode.assert_not_called()
+        mock_sendgrid_client.send.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_stats(mock_component_config, mock_sendgrid_client):
+    """Test get_stats reports stage latencies and counters by status code and error class, and resets."""
+    responses = [MagicMock(status_code=202), MagicMock(status_code=202), Exception("API Error")]
+    mock_sendgrid_client.send.side_effect = responses
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Test Subject",
+            "body": "<p>Test Body</p>"
+        }
+        for _ in responses:
+            await email_service.do_command(command)
+
+        stats = await email_service.do_command({"command": "get_stats", "reset": True})
+        assert stats["counters"]["status_202"] == 2
+        assert stats["counters"]["error_Exception"] == 1
+        assert stats["gauges"]["in_flight"] == 0
+        assert stats["latency"]["render"]["count"] == 3
+        assert stats["latency"]["http"]["count"] == 3
+        assert 0 < stats["latency"]["http"]["p50"] <= stats["latency"]["http"]["p99"]
+
+        stats = await email_service.do_command({"command": "get_stats"})
+        assert stats["latency"] == {}
+        assert "status_202" not in stats["counters"]
+
+def test_histogram_quantiles():
+    """Test histogram quantiles fall within one bucket of the true value."""
+    from src.stats import Histogram
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.observe(i / 1000)
+    assert 0.5 <= histogram.quantile(0.5) <= 0.5 * 1.1
+    assert 0.99 <= histogram.quantile(0.99) <= 1.0
+
+@pytest.mark.asyncio
+async def test_stats_port_listens_on_localhost(mock_component_config, mock_sendgrid_client):
+    """Test the metrics endpoint listens only on localhost unless stats_host is set."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"stats_port": port}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        await asyncio.sleep(0.05)
+        assert [sock.getsockname()[0] for sock in email_service.stats_exporter.server.sockets] == ["127.0.0.1"]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_reconfigure_diffs_presets(mock_component_config, mock_sendgrid_client):
+    """Test reconfigure reuses unchanged presets, recompiles edited ones and drops removed ones."""
+    presets = {
+        "alert": {"subject": "Alert: <<issue>>", "body": "<<issue>>"},
+        "report": {"subject": "Report", "body": "<<summary>>"},
+        "old": {"subject": "Old", "body": "Old"},
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"preset_messages": presets}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+    alert = email_service.send_config.presets["alert"]
+    report = email_service.send_config.presets["report"]
+
+    presets = {
+        "alert": {"subject": "Alert: <<issue>>", "body": "<<issue>>"},
+        "report": {"subject": "Daily report", "body": "<<summary>>"},
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"preset_messages": presets}), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client) as transport:
+        email_service.reconfigure(mock_component_config, {})
+        transport.assert_not_called()
+
+    assert set(email_service.send_config.presets) == {"alert", "report"}
+    assert email_service.send_config.presets["alert"] is alert
+    assert email_service.send_config.presets["report"] is not report
+    assert email_service.send_config.presets["report"].subject == "Daily report"
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        other_service = sendgridEmail.new(mock_component_config, {})
+    assert other_service.send_config.presets == {}
+
+@pytest.mark.asyncio
+async def test_reconfigure_during_send(mock_component_config, mock_sendgrid_client):
+    """Test a send in flight during a reconfigure finishes on the config it started with."""
+    async def slow_send(payload):
+        await asyncio.sleep(0.1)
+        return MagicMock(status_code=202)
+    mock_sendgrid_client.send.side_effect = slow_send
+    command = {"command": "send", "to": ["test@example.com"], "subject": "Test Subject", "body": "<p>Test Body</p>"}
+
+    with patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        in_flight = asyncio.create_task(email_service.do_command(command))
+        await asyncio.sleep(0.02)
+        with patch("src.sendgridEmail.struct_to_dict", return_value={"send_timeout": 0.05}):
+            email_service.reconfigure(mock_component_config, {})
+
+        assert await in_flight == {"status_code": 202}
+        assert await email_service.do_command(command) == {"error": "send timed out"}
+        await email_service.close()
+
+@pytest.mark.asyncio
+async def test_render_cache(mock_component_config, mock_sendgrid_client):
+    """Test repeated preset sends reuse the cached render, and editing the preset invalidates it."""
+    import json
+    from src.transport import encode_payload
+    mock_sendgrid_client.send.return_value = MagicMock(status_code=202)
+    preset_config = {"preset_messages": {"alert": {"subject": "Alert: <<issue>>", "body": "Issue detected: <<issue>>"}}}
+    command = {"command": "send", "preset": "alert", "template_vars": {"issue": "Test Issue"}}
+
+    with patch("src.sendgridEmail.struct_to_dict", return_value=preset_config), \
+         patch("src.sendgridEmail.SendGridTransport", return_value=mock_sendgrid_client):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        await email_service.do_command({**command, "to": ["first@example.com"]})
+        await email_service.do_command({**command, "to": ["second@example.com", "Third <third@example.com>"]})
+        first, second = [call[0][0] for call in mock_sendgrid_client.send.call_args_list]
+        assert await email_service.do_command({"command": "render_cache_status"}) == \
+            {"entries": 1, "bytes": email_service.render_cache.size, "hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+        assert second["personalizations"] == [{"to": [{"email": "second@example.com"}, {"name": "Third", "email": "third@example.com"}]}]
+        assert {k: v for k, v in second.items() if k != "personalizations"} == {k: v for k, v in first.items() if k != "personalizations"}
+        assert json.loads(encode_payload(second)) == dict(second)
+
+        preset_config["preset_messages"] = {"alert": {"subject": "Warning: <<issue>>", "body": "Issue detected: <<issue>>"}}
+        email_service.reconfigure(mock_component_config, {})
+        assert email_service.render_cache.stats()["entries"] == 0
+        await email_service.do_command({**command, "to": ["first@example.com"]})
+        assert mock_sendgrid_client.send.call_args[0][0]["subject"] == "Warning: Test Issue"
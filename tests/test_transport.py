@@ -0,0 +1,54 @@
+import pytest
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+from src.transport import SendGridTransport, SendGridError
+
+@pytest.mark.asyncio
+async def test_transport_reuses_connections(sendgrid_stub):
+    """Test sequential sends share one keep-alive connection."""
+    transport = SendGridTransport("SG.test-key", host=sendgrid_stub.url)
+    for _ in range(5):
+        response = await transport.send({"subject": "Test Subject"})
+        assert response.status_code == 202
+    await transport.close()
+
+    assert len(sendgrid_stub.requests) == 5
+    assert sendgrid_stub.connections == 1
+    request_line, headers, body = sendgrid_stub.requests[0]
+    assert request_line.startswith("POST /v3/mail/send")
+    assert headers["authorization"] == "Bearer SG.test-key"
+    assert body == {"subject": "Test Subject"}
+
+@pytest.mark.asyncio
+async def test_transport_raises_on_error_status(sendgrid_stub):
+    """Test an error response from SendGrid raises SendGridError."""
+    sendgrid_stub.responses.append((400, {}))
+    transport = SendGridTransport("SG.test-key", host=sendgrid_stub.url)
+    with pytest.raises(SendGridError) as exc_info:
+        await transport.send({"subject": "Test Subject"})
+    await transport.close()
+    assert exc_info.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_reconfigure_reuses_transport(mock_component_config, sendgrid_stub):
+    """Test the connection pool survives reconfigure and do_command calls while the api_key is unchanged."""
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"api_host": sendgrid_stub.url}):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        transport = email_service.key_pool.keys[0].transport
+        command = {
+            "command": "send",
+            "to": ["test@example.com"],
+            "subject": "Test Subject",
+            "body": "<p>Test Body</p>"
+        }
+        assert await email_service.do_command(command) == {"status_code": 202}
+        email_service.reconfigure(mock_component_config, {})
+        assert email_service.key_pool.keys[0].transport is transport
+        assert await email_service.do_command(command) == {"status_code": 202}
+        assert sendgrid_stub.connections == 1
+
+        mock_component_config.attributes.fields["api_key"].string_value = "SG.other-key"
+        email_service.reconfigure(mock_component_config, {})
+        assert email_service.key_pool.keys[0].transport is not transport
+        await email_service.close()
+        await transport.close()
@@ -0,0 +1,103 @@
+import base64
+import pytest
+from email import message_from_bytes
+from email.policy import default
+from unittest.mock import patch
+from src.sendgridEmail import sendgridEmail
+
+SEND_COMMAND = {
+    "command": "send",
+    "to": ["test@example.com"],
+    "subject": "Test Subject",
+    "body": "<p>Test Body</p>"
+}
+
+def smtp_config(smtp_stub, **attributes):
+    return {"transport": "smtp", "smtp_host": "127.0.0.1", "smtp_port": smtp_stub.port, "smtp_security": "none", **attributes}
+
+@pytest.mark.asyncio
+async def test_smtp_reuses_authenticated_connection(mock_component_config, smtp_stub):
+    """Test SMTP sends log in once and share one session."""
+    with patch("src.sendgridEmail.struct_to_dict", return_value=smtp_config(smtp_stub)):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for _ in range(3):
+            assert await email_service.do_command(SEND_COMMAND) == {"status_code": 202}
+        await email_service.close()
+
+    assert smtp_stub.connections == 1
+    assert smtp_stub.logins == 1
+    assert len(smtp_stub.messages) == 3
+    sender, recipients, content = smtp_stub.messages[0]
+    assert sender == "from@example.com"
+    assert recipients == ["test@example.com"]
+    message = message_from_bytes(content, policy=default)
+    assert message["Subject"] == "Test Subject"
+    assert message["From"] == "Test Sender <from@example.com>"
+    assert message.get_content_type() == "text/html"
+    assert message.get_content().strip() == "<p>Test Body</p>"
+
+@pytest.mark.asyncio
+async def test_smtp_batch_with_attachment(mock_component_config, smtp_stub):
+    """Test a batch over SMTP sends one message per recipient, with substitutions and the attachment intact."""
+    attachment = bytes(range(256)) * 4
+    command = {
+        "command": "send_batch",
+        "subject": "Alert: <<about>>",
+        "body": "<p><<about>> needs attention</p>",
+        "recipients": [
+            {"to": "ops@example.com", "template_vars": {"about": "battery"}},
+            {"to": "lead@example.com", "template_vars": {"about": "motor"}},
+        ],
+        "attachments": [{"content": base64.b64encode(attachment).decode(), "filename": "log.bin", "mime_type": "application/octet-stream"}],
+    }
+    with patch("src.sendgridEmail.struct_to_dict", return_value=smtp_config(smtp_stub)):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(command)
+        await email_service.close()
+
+    assert [entry["status_code"] for entry in result["results"]] == [202, 202]
+    messages = {recipients[0]: message_from_bytes(content, policy=default) for _, recipients, content in smtp_stub.messages}
+    assert messages["ops@example.com"]["Subject"] == "Alert: battery"
+    assert messages["lead@example.com"]["Subject"] == "Alert: motor"
+    body, part = list(messages["lead@example.com"].iter_parts())
+    assert "motor needs attention" in body.get_content()
+    assert part.get_filename() == "log.bin"
+    assert part.get_content() == attachment
+
+@pytest.mark.asyncio
+async def test_smtp_refused_recipient(mock_component_config, smtp_stub):
+    """Test a refused recipient fails the send without retries and the session is kept."""
+    smtp_stub.reject.add("nobody@example.com")
+    with patch("src.sendgridEmail.struct_to_dict", return_value=smtp_config(smtp_stub)):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command({**SEND_COMMAND, "to": ["nobody@example.com"]})
+        assert result["error"].startswith("SMTP Error 550")
+        assert await email_service.do_command(SEND_COMMAND) == {"status_code": 202}
+        await email_service.close()
+    assert smtp_stub.connections == 1
+    assert len(smtp_stub.messages) == 1
+
+@pytest.mark.asyncio
+async def test_smtp_bad_password_ejects_key(mock_component_config, smtp_stub):
+    """Test an SMTP login failure is reported like a rejected API key."""
+    smtp_stub.password = "something-else"
+    with patch("src.sendgridEmail.struct_to_dict", return_value=smtp_config(smtp_stub, max_retries=0)):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        result = await email_service.do_command(SEND_COMMAND)
+        keys = (await email_service.do_command({"command": "key_status"}))["keys"]
+        await email_service.close()
+    assert result["error"].startswith("SMTP Error 535")
+    assert keys[0]["ejections"] == 1
+
+@pytest.mark.asyncio
+async def test_memory_transport_records_sends(mock_component_config):
+    """Test the memory transport accepts sends without a network and reports what it recorded."""
+    with patch("src.sendgridEmail.struct_to_dict", return_value={"transport": "memory", "memory_capacity": 2}):
+        email_service = sendgridEmail.new(mock_component_config, {})
+        for i in range(3):
+            assert await email_service.do_command({**SEND_COMMAND, "subject": f"Subject {i}"}) == {"status_code": 202}
+        recorded = await email_service.do_command({"command": "recorded_messages", "clear": True})
+        assert recorded["count"] == 3
+        assert [message["subject"] for message in recorded["messages"]] == ["Subject 1", "Subject 2"]
+        assert (await email_service.do_command({"command": "recorded_messages"}))["messages"] == []
+        await email_service.close()